@@ -0,0 +1,267 @@
+import asyncio
+import json
+import ssl
+from http.client import HTTPMessage
+from urllib.parse import urlencode, urlsplit
+
+from tiliadoweb.api import ApiError, auth_header, TEST_USER
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+class AsyncResponse:
+    def __init__(self, status, reason, headers, data):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.data = data
+
+class AsyncConnectionPool:
+    def __init__(self, limit=16, max_idle=16, timeout=None, verify_ssl=True):
+        self.limit = limit
+        self.max_idle = max_idle
+        self.timeout = timeout
+        if verify_ssl:
+            self.ssl_context = ssl.create_default_context()
+        else:
+            self.ssl_context = ssl._create_unverified_context()
+        self._idle = {}
+        self._semaphore = None
+        self.requests = 0
+        self.connections = 0
+        self.reused = 0
+        self.reconnects = 0
+    
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "connections": self.connections,
+            "reused": self.reused,
+            "reconnects": self.reconnects,
+            "idle": sum(len(idle) for idle in self._idle.values()),
+        }
+    
+    async def close(self):
+        idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for reader, writer in connections:
+                writer.close()
+    
+    async def request(self, method, url, body=None, headers=None):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        async with self._semaphore:
+            if self.timeout is None:
+                return await self._request(method, url, body, headers)
+            return await asyncio.wait_for(self._request(method, url, body, headers), self.timeout)
+    
+    async def _request(self, method, url, body, headers):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port or DEFAULT_PORTS[parts.scheme])
+        path = parts.path or "/"
+        if parts.query:
+            path = "{}?{}".format(path, parts.query)
+        
+        lines = ["{} {} HTTP/1.1".format(method, path), "Host: {}".format(parts.netloc)]
+        headers = dict(headers or {})
+        if body is not None:
+            headers["Content-Length"] = str(len(body))
+        lines.extend("{}: {}".format(name, value) for (name, value) in headers.items())
+        request = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + (body or b"")
+        
+        idle = self._idle.get(key)
+        if idle:
+            self.reused += 1
+            connection = idle.pop()
+            try:
+                return await self._exchange(key, connection, request)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # The server has closed the kept-alive connection in the meantime.
+                self.reconnects += 1
+        
+        self.connections += 1
+        connection = await asyncio.open_connection(key[1], key[2],
+            ssl=self.ssl_context if key[0] == "https" else None)
+        return await self._exchange(key, connection, request)
+    
+    async def _exchange(self, key, connection, request):
+        reader, writer = connection
+        try:
+            writer.write(request)
+            await writer.drain()
+            status_line = await reader.readuntil(b"\r\n")
+            version, status, reason = (status_line.decode("latin-1").rstrip("\r\n").split(" ", 2) + [""])[:3]
+            headers = HTTPMessage()
+            while True:
+                line = await reader.readuntil(b"\r\n")
+                if line == b"\r\n":
+                    break
+                name, value = line.decode("latin-1").split(":", 1)
+                headers[name.strip()] = value.strip()
+            
+            status = int(status)
+            keep_alive = version == "HTTP/1.1" and headers.get("Connection", "").lower() != "close"
+            if status in (204, 304) or 100 <= status < 200:
+                data = b""
+            elif headers.get("Transfer-Encoding", "").lower() == "chunked":
+                chunks = []
+                while True:
+                    size = int((await reader.readuntil(b"\r\n")).split(b";", 1)[0], 16)
+                    if not size:
+                        while await reader.readuntil(b"\r\n") != b"\r\n":
+                            pass
+                        break
+                    chunks.append(await reader.readexactly(size))
+                    await reader.readexactly(2)
+                data = b"".join(chunks)
+            elif "Content-Length" in headers:
+                data = await reader.readexactly(int(headers["Content-Length"]))
+            else:
+                data = await reader.read()
+                keep_alive = False
+        except BaseException:
+            writer.close()
+            raise
+        
+        self.requests += 1
+        idle = self._idle.setdefault(key, [])
+        if keep_alive and len(idle) < self.max_idle:
+            idle.append(connection)
+        else:
+            writer.close()
+        return AsyncResponse(status, reason, headers, data)
+
+class AsyncTiliadoApi:
+    def __init__(self, server, api_path, api_auth, username=None, token=None, pool=None, limit=16):
+        self.root = server + api_path
+        self.api_auth = server + api_auth
+        self.token = token
+        self.username = username
+        self.pool = pool or AsyncConnectionPool(limit=limit)
+    
+    async def close(self):
+        await self.pool.close()
+    
+    async def login(self, username, password, scope="default"):
+        if not username:
+            raise ApiError("Username field is empty.")
+        if not password:
+            raise ApiError("Password field is empty.")
+        if not scope:
+            raise ApiError("Scope field is empty.")
+        
+        data = urlencode({"username": username, "password": password, "scope": scope})
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        response = await self._send("POST", self.api_auth, data.encode("ascii"), headers)
+        if response.status == 400:
+            raise ApiError("Unable to login with provided credentials.")
+        self._check_status(response)
+        
+        try:
+            token = json.loads(response.data.decode("utf-8"))["token"]
+        except Exception as e:
+            print("Failed to read response from server. %s" % e)
+            raise ApiError("Failed to read response from server.")
+        
+        self.username = username
+        self.scope = scope
+        self.token = token
+    
+    async def make_request(self, path, params=None, data=None, headers=None):
+        headers = headers or {}
+        if self.token and self.username:
+            headers["Authorization"] = auth_header(self.username, self.token)
+        if params:
+            path = "{}?{}".format(path, urlencode(params))
+        
+        response = await self._send("GET" if data is None else "POST", self.root + path, data, headers)
+        self._check_status(response)
+        return json.loads(response.data.decode("utf-8"))
+    
+    async def _send(self, method, url, data, headers):
+        try:
+            return await self.pool.request(method, url, data, headers)
+        except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+            print("Failed to connect to server: %s" % e)
+            raise ApiError("Failed to connect to server.")
+    
+    def _check_status(self, response):
+        if response.status >= 400:
+            print("Server has returned an error: %s." % response.data.decode("utf-8", errors="replace"))
+            raise ApiError("Server has returned an error: %s." % response.reason.lower())
+    
+    # Properties return coroutines so that they are used the same way as in TiliadoApi: `await api.me`.
+    
+    @property
+    def me(self):
+        return self.make_request("me/")
+    
+    @property
+    def repositories(self):
+        return self.make_request("repository/repositories/")
+    
+    @property
+    def repo_releases(self):
+        return self.make_request("repository/releases/")
+    
+    @property
+    def distributions(self):
+        return self.make_request("repository/distributions/")
+    
+    @property
+    def groups(self):
+        return self.make_request("auth/groups/")
+    
+    @property
+    def all_products(self):
+        return self.make_request("repository/products/")
+    
+    async def component(self, identifier):
+        return await self.make_request("repository/components/{}/".format(identifier))
+    
+    async def list_products(self, **params):
+        return await self.make_request("repository/products/", params=params)
+    
+    async def list_packages(self, **params):
+        return await self.make_request("repository/packages/", params=params)
+
+async def walk(api):
+    me, repositories, groups = await asyncio.gather(api.me, api.repositories, api.groups)
+    groups = {group["id"]: group for group in groups}
+    print(me)
+    
+    async def walk_repo(repo):
+        products, components = await asyncio.gather(
+            api.list_products(repository=repo["id"]),
+            asyncio.gather(*(api.component(pk) for pk in repo.get("component_set", ()))))
+        print("Repo: {}".format(repo))
+        lookups = []
+        for component in components:
+            print("Component: {}".format(component))
+            for access in component["access_set"]:
+                for group_pk in access["groups"]:
+                    print("Group {}: {}".format(group_pk, groups.get(group_pk)))
+                for product in products:
+                    for pkg_name in product["packages"].split(","):
+                        lookups.append(api.list_packages(repository=repo["id"], component=component["id"],
+                            release=access["release"], name=pkg_name))
+        for packages in await asyncio.gather(*lookups):
+            for package in packages:
+                print("Package: {}".format(package["id"]))
+    
+    await asyncio.gather(*(walk_repo(repo) for repo in repositories))
+
+async def run_main():
+    from tiliadoweb.config import SERVER, API_PATH, API_AUTH
+    api = AsyncTiliadoApi(SERVER, API_PATH, API_AUTH)
+    try:
+        await api.login(*TEST_USER)
+        await walk(api)
+        print("Connections: {}".format(api.pool.stats()))
+    finally:
+        await api.close()
+
+def main():
+    asyncio.run(run_main())
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,146 @@
-from urllib.request import urlopen, Request
-from urllib.error import HTTPError
-from urllib.parse import urlencode, quote as urlquote
+from urllib.parse import urlencode, urljoin, quote as urlquote
 from base64 import b64encode
+from http.client import HTTPException
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from itertools import chain
+import codecs
 import json
+import re
+import socket
+import time
 
-import tiliadoweb
+from tiliadoweb.connection import ConnectionPool
+from tiliadoweb.catalog import PackageIndex
+from tiliadoweb.memo import Memo
+from tiliadoweb.retry import Deadline, RetryBudget, LatencyTracker, backoff
+from tiliadoweb.metrics import ApiMetrics, endpoint_name
+from tiliadoweb.store import EntityStore
 
 TEST_USER = "test", "test"
 
 class ApiError(Exception):
+    retryable = False
+
+class NetworkError(ApiError):
+    retryable = True
+
+class ApiTimeoutError(NetworkError):
+    pass
+
+class DeadlineExceededError(ApiTimeoutError):
+    # Raised before a request is sent because the deadline of the calling step has passed or has been cancelled.
+    # Callers sharing the call through single flight have their own deadlines and try again.
+    caller_specific = True
+
+class ServerError(ApiError):
+    RETRYABLE_STATUSES = frozenset((429, 502, 503, 504))
+    
+    def __init__(self, message, status=None):
+        ApiError.__init__(self, message)
+        self.status = status
+        self.retryable = status in self.RETRYABLE_STATUSES
+
+class NotFoundError(ServerError):
     pass
 
+def network_error(e):
+    if isinstance(e, socket.timeout):
+        print("Request to server has timed out: %s" % e)
+        return ApiTimeoutError("Server has not responded in time.")
+    print("Failed to connect to server: %s" % e)
+    return NetworkError("Failed to connect to server.")
+
+# Deadline of the current wizard step, see TiliadoApi.deadline().
+_deadline = ContextVar("deadline", default=None)
+
+def auth_header(username, token):
+    #Authorization: Token  base64(username) 401f7ac837da42b97f613d789819ff93537bee6a
+    return "Token %s %s" % (b64encode(username.encode("utf-8")).decode("ascii"), token)
+
+_SEPARATORS = re.compile(r"[\s,]*")
+
+def iter_json_array(chunks):
+    # Yields items of a top-level JSON array as soon as they are complete in the stream of byte chunks.
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    started = False
+    buffer = ""
+    pos = 0
+    for chunk in chunks:
+        buffer = buffer[pos:] + text_decoder.decode(chunk)
+        pos = 0
+        while True:
+            pos = _SEPARATORS.match(buffer, pos).end()
+            if pos >= len(buffer):
+                break
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError("JSON array expected.")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                break  # Incomplete item, wait for more data.
+            if isinstance(item, (int, float)) and (end == len(buffer) or buffer[end] not in ",] \t\r\n"):
+                break  # A number may continue in the next chunk.
+            yield item
+            pos = end
+    raise ValueError("Unexpected end of JSON array.")
+
+def first_chunk(chunks):
+    for chunk in chunks:
+        chunk = chunk.lstrip()
+        if chunk:
+            return chunk
+    return b""
+
+def collect_chunks(chunks, body):
+    for chunk in chunks:
+        body.append(chunk)
+        yield chunk
+
+def load_json(chunks):
+    # Arrays are decoded item by item while the rest of the response is still being received.
+    chunks = iter(chunks)
+    first = first_chunk(chunks)
+    if first.startswith(b"["):
+        return list(iter_json_array(chain((first,), chunks)))
+    return json.loads(b"".join(chain((first,), chunks)))
+
 class TiliadoApi:
-    def __init__(self, server, api_path, api_auth, username=None, token=None):
+    def __init__(self, server, api_path, api_auth, username=None, token=None, pool=None, cache=None,
+            max_workers=8, timeout=20, retries=3, retry_budget=None, hedge=False, hedge_after=None, metrics=None):
         self.root = server + api_path
         self.api_auth = server + api_auth
         self.token = token
         self.username = username
-        self._groups = None
-        self._distributions = None
-        self._repo_releases = None
+        self.pool = pool or ConnectionPool()
+        self.cache = cache
+        self.max_workers = max_workers
+        self._executor = None
+        self._hedge_executor = None
+        self.memo = Memo()
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_budget = retry_budget or RetryBudget()
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.latency = LatencyTracker()
+        self.metrics = metrics or ApiMetrics()
+        self.stores = {
+            "repo_releases": self._create_store("repository/releases/{}/", lambda: self.repo_releases),
+            "distributions": self._create_store("repository/distributions/{}/", lambda: self.distributions),
+            "groups": self._create_store("auth/groups/{}/", lambda: self.groups),
+            "components": self._create_store("repository/components/{}/"),
+        }
+        self.retried = 0
+        self.hedged = 0
     
     def login(self, username, password, scope="default"):
         if not username:
@@ -29,16 +150,14 @@ class TiliadoApi:
         if not scope:
             raise ApiError("Scope field is empty.")
         
-        try:
-            data = urlencode({"username": username, "password": password, "scope": scope})
-            response = urlopen(self.api_auth, data.encode("ascii"))
-        except HTTPError as e:
-            if e.code == 400:
-                raise ApiError("Unable to login with provided credentials.")
-            print("Server has returned an error: %s." % e.read().decode("utf-8"))
-            raise ApiError("Server has returned an error: %s." % str(e.reason).lower())
-        
-        data = response.read() 
+        data = urlencode({"username": username, "password": password, "scope": scope})
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        response = self._send("POST", self.api_auth, data.encode("ascii"), headers, self._timeout(_deadline.get()))
+        if response.status == 400:
+            raise ApiError("Unable to login with provided credentials.")
+        self._check_status(response)
+        
+        data = response.data
         try:
             token = json.loads(data.decode("utf-8"))["token"];
         except Exception as e:
@@ -48,101 +167,322 @@ class TiliadoApi:
         self.username = username
         self.scope = scope
         self.token = token
+        self.invalidate()
+    
+    def logout(self):
+        self.username = None
+        self.token = None
+        self.invalidate()
+    
+    def invalidate(self):
+        self.memo.invalidate()
+        for store in self.stores.values():
+            store.invalidate()
+    
+    def _create_store(self, path, load_all=None):
+        return EntityStore(lambda key: self.make_request(path.format(key)), load_all, not_found=NotFoundError,
+            map=self.map)
+    
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+    
+    def shutdown(self):
+        # Queued work is dropped, requests in flight are not waited for.
+        for executor in (self._executor, self._hedge_executor):
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+    
+    def map(self, func, items):
+        items = list(items)
+        if len(items) < 2:
+            return [func(item) for item in items]
+        # Worker threads run in a copy of the caller's context to share its deadline.
+        futures = [self.executor.submit(copy_context().run, func, item) for item in items]
+        return [future.result() for future in futures]
     
-    def make_request(self, path, params=None, data=None, headers=None):
+    @contextmanager
+    def deadline(self, timeout):
+        deadline = Deadline(timeout)
+        token = _deadline.set(deadline)
+        try:
+            yield deadline
+        finally:
+            _deadline.reset(token)
+    
+    def make_request(self, path, params=None, data=None, headers=None, revalidate=False):
+        # With revalidate, a cached response is never used without asking the server whether it is still valid.
         headers = headers or {}
         
         if self.token and self.username:
-            #Authorization: Token  base64(username) 401f7ac837da42b97f613d789819ff93537bee6a
-            headers["Authorization"] = "Token %s %s" % (b64encode(self.username.encode("utf-8")).decode("ascii"), self.token)
+            headers["Authorization"] = auth_header(self.username, self.token)
+        
+        if params:
+            path = "{}?{}".format(path, urlencode(params))
+        
+        url = self.root + path
+        cache = self.cache if data is None else None
+        ttl = cache.ttl(path) if cache else None
+        key = entry = None
+        if ttl is not None:
+            key = cache.key(url, self.username if self.token else None)
+            entry = cache.get(key)
+            if entry is not None:
+                if not revalidate and entry.is_fresh(ttl):
+                    cache.hits += 1
+                    self.metrics.record_cache(endpoint_name(url), "hit")
+                    return entry.data
+                headers.update(entry.conditional_headers())
+        
+        method = "GET" if data is None else "POST"
+        
+        def fetch(timeout):
+            response = self._open(method, url, data, headers, timeout)
+            if response.status == 304 and entry is not None:
+                response.read()
+                return response, None, None
+            self._check_status(response)
+            body = [] if key is not None else None
+            return response, self._load(response, body), body
         
+        if method == "GET":
+            response, data, body = self._call(fetch, self.hedge)
+        else:
+            response, data, body = fetch(self._timeout(_deadline.get()))
+        
+        if response.status == 304 and entry is not None:
+            cache.revalidated += 1
+            self.metrics.record_cache(endpoint_name(url), "revalidated")
+            cache.touch(key)
+            return entry.data
+        
+        if key is not None:
+            cache.misses += 1
+            self.metrics.record_cache(endpoint_name(url), "miss")
+            cache.store(key, url, response.headers, b"".join(body), data)
+        return data
+    
+    def iter_request(self, path, params=None):
+        # Follows server-side pagination: either a plain JSON array, which is decoded item by item as it arrives,
+        # or pages like {"results": [...], "next": "<url>"}.
+        headers = {}
+        if self.token and self.username:
+            headers["Authorization"] = auth_header(self.username, self.token)
         if params:
             path = "{}?{}".format(path, urlencode(params))
         
-        request = Request(self.root + path, data, headers)
+        url = self.root + path
+        
+        def open_page(timeout):
+            response = self._open("GET", url, None, headers, timeout)
+            self._check_status(response)
+            return response
+        
+        while url:
+            page = {}
+            response = self._call(open_page)
+            try:
+                yield from self._iter_page(response, page)
+            except (OSError, HTTPException) as e:
+                raise network_error(e)
+            except ValueError as e:
+                print("Failed to read response from server. %s" % e)
+                raise ApiError("Failed to read response from server.")
+            finally:
+                response.close()
+            
+            url = urljoin(url, page["next"]) if page.get("next") else None
+    
+    def _iter_page(self, response, page):
+        chunks = response.iter_chunks()
+        first = first_chunk(chunks)
+        if first.startswith(b"["):
+            yield from iter_json_array(chain((first,), chunks))
+        else:
+            page.update(json.loads(b"".join(chain((first,), chunks))))
+            yield from page.get("results", ())
+    
+    def _load(self, response, body=None):
+        chunks = response.iter_chunks()
+        if body is not None:
+            chunks = collect_chunks(chunks, body)
+        try:
+            return load_json(chunks)
+        except (OSError, HTTPException) as e:
+            raise network_error(e)
+        except ValueError as e:
+            print("Failed to read response from server. %s" % e)
+            raise ApiError("Failed to read response from server.")
+        finally:
+            response.close()
+    
+    def _open(self, method, url, data, headers, timeout=None, read=False):
+        endpoint = endpoint_name(url)
+        sent = len(data or b"")
+        
+        def on_close(response, elapsed):
+            self.metrics.record(endpoint, elapsed, response.received, sent, response.status >= 400)
+        
+        started = time.monotonic()
+        try:
+            if read:
+                return self.pool.request(method, url, data, headers, timeout, on_close)
+            return self.pool.open(method, url, data, headers, timeout, on_close)
+        except (OSError, HTTPException) as e:
+            self.metrics.record(endpoint, time.monotonic() - started, 0, sent, True)
+            raise network_error(e)
+    
+    def _send(self, method, url, data, headers, timeout=None):
+        return self._open(method, url, data, headers, timeout, read=True)
+    
+    def _timeout(self, deadline):
+        if deadline is None:
+            return self.timeout
+        if deadline.expired():
+            raise DeadlineExceededError("Time limit for the current step has been exceeded.")
+        return deadline.timeout(self.timeout)
+    
+    def _call(self, fetch, hedge=False):
+        # Runs an idempotent request, retrying transient failures with a jittered exponential backoff as long as
+        # the retry budget and the deadline of the current step allow.
+        deadline = _deadline.get()
+        attempt = 0
+        while True:
+            timeout = self._timeout(deadline)
+            started = time.monotonic()
+            try:
+                result = self._hedged(fetch, timeout) if hedge else fetch(timeout)
+            except ApiError as e:
+                if not e.retryable or attempt >= self.retries or not self.retry_budget.withdraw():
+                    raise
+                delay = backoff(attempt)
+                remaining = deadline.remaining() if deadline is not None else None
+                if remaining is not None and delay >= remaining:
+                    raise
+                attempt += 1
+                self.retried += 1
+                print("Retrying request in %.2f s: %s" % (delay, e))
+                time.sleep(delay)
+                continue
+            
+            self.latency.add(time.monotonic() - started)
+            self.retry_budget.deposit()
+            return result
+    
+    def _hedged(self, fetch, timeout):
+        # Fires a duplicate request if the first one is slower than the usual 95th percentile, the first
+        # response wins.
+        threshold = self.hedge_after if self.hedge_after is not None else self.latency.percentile(95)
+        if threshold is None or (timeout is not None and threshold >= timeout):
+            return fetch(timeout)
+        
+        if self._hedge_executor is None:
+            self._hedge_executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        first = self._hedge_executor.submit(copy_context().run, fetch, timeout)
         try:
-            response = urlopen(request)
-            data = response.read() 
-            return json.loads(data.decode("utf-8"));
-        except HTTPError as e:
-            print("Server has returned an error: %s." % e.read().decode("utf-8"))
-            raise ApiError("Server has returned an error: %s." % str(e.reason).lower())
+            return first.result(threshold)
+        except FutureTimeoutError:
+            pass
+        
+        self.hedged += 1
+        second = self._hedge_executor.submit(copy_context().run, fetch,
+            None if timeout is None else max(0.001, timeout - threshold))
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result()
+                except ApiError as e:
+                    error = e
+        raise error
+    
+    def _check_status(self, response):
+        if response.status >= 400:
+            try:
+                data = response.read()
+            except (OSError, HTTPException):
+                data = b""
+            print("Server has returned an error: %s." % data.decode("utf-8", errors="replace"))
+            error = NotFoundError if response.status == 404 else ServerError
+            raise error("Server has returned an error: %s." % str(response.reason).lower(), response.status)
     
     @property
     def me(self):
-        return self.make_request("me/")
+        return self.memo.get("me", lambda: self.make_request("me/"))
     
     @property
     def repositories(self):
-        return self.make_request("repository/repositories/")
+        return self.memo.get("repositories", lambda: self.make_request("repository/repositories/"))
     
     @property
     def repo_releases(self):
-        return self.make_request("repository/releases/")
+        return self.memo.get("repo_releases", lambda: self.make_request("repository/releases/"))
     
     def repo_release(self, key):
-        if self._repo_releases is None:
-            self._repo_releases = {i["id"]: i for i in self.repo_releases}
-        try:
-            return self._repo_releases[key]
-        except KeyError:
-            repo_release = self._repo_releases[key] = self.make_request("repository/releases/".format(key))
-            return repo_release
-   
+        return self.stores["repo_releases"].get(key)
+    
     @property
     def distributions(self):
-        return self.make_request("repository/distributions/")
+        return self.memo.get("distributions", lambda: self.make_request("repository/distributions/"))
     
     def distribution(self, key):
-        if self._distributions is None:
-            self._distributions = {i["id"]: i for i in self.distributions}
-        try:
-            return self._distributions[key]
-        except KeyError:
-            distribution = self._distributions[key] = self.make_request("repository/distributions/".format(key))
-            return distribution
+        return self.stores["distributions"].get(key)
     
     def component(self, identifier):
-        return self.make_request("repository/components/{}/".format(identifier))
+        return self.stores["components"].get(identifier)
+    
+    def components(self, identifiers):
+        return self.stores["components"].get_many(identifiers)
     
     @property
     def groups(self):
-        return self.make_request("auth/groups/")
+        return self.memo.get("groups", lambda: self.make_request("auth/groups/"))
         
     def group(self, key):
-        if self._groups is None:
-            self._groups = {group["id"]: group for group in self.groups}
-        try:
-            return self._groups[key]
-        except KeyError:
-            group = self._groups[key] = self.make_request("auth/groups/".format(key))
-            return group
+        return self.stores["groups"].get(key)
     
     @property
     def all_products(self):
-        return self.make_request("repository/products/")
+        return self.memo.get("all_products", lambda: self.make_request("repository/products/"))
     
     def list_products(self, **params):
         return self.make_request("repository/products/", params=params)
+    
+    def iter_products(self, **params):
+        return self.iter_request("repository/products/", params=params)
+    
+    def iter_repositories(self, **params):
+        return self.iter_request("repository/repositories/", params=params)
         
     def list_packages(self, **params):
         return self.make_request("repository/packages/", params=params)
     
+    def iter_packages(self, **params):
+        return self.iter_request("repository/packages/", params=params)
+    
+    def package_index(self, repository, release):
+        return self.memo.get(("package_index", repository, release), lambda: PackageIndex.from_packages(
+            repository, release, self.iter_packages(repository=repository, release=release)))
+    
 def main():
-    api = TiliadoApi(tiliadoweb.DEVEL_SERVER, tiliadoweb.DEFAULT_API_PATH, tiliadoweb.DEFAULT_API_AUTH)
+    from tiliadoweb.config import SERVER, API_PATH, API_AUTH
+    api = TiliadoApi(SERVER, API_PATH, API_AUTH)
     api.login(*TEST_USER)
     print("Auth: user = '{api.username}', scope = '{api.scope}', token = '{api.token}'".format(api=api))
     
     print(api.me)
     
-    for product in api.all_products:
+    for product in api.iter_products():
         print("Product: {}".format(product))
     
-    repositories = api.repositories
-    for repo in repositories:
+    for repo in api.iter_repositories():
         print("Repo: {}".format(repo))
         product = None
-        for product in api.list_products(repository=repo["id"]):
+        for product in api.iter_products(repository=repo["id"]):
             print("Product: {}".format(product))
         
         for pk in repo.get("component_set", ()):
@@ -156,8 +496,7 @@ def main():
                 release = access["release"]
                 if product:
                     for pkg_name in product["packages"].split(","):
-                        packages = api.list_packages(repository=repo["id"], component=pk, release=release, name=pkg_name)
-                        for package in packages:
+                        for package in api.iter_packages(repository=repo["id"], component=pk, release=release, name=pkg_name):
                             print("Package: {}".format(package["id"]))
 
     for distribution in api.distributions:
@@ -166,5 +505,7 @@ def main():
     for release in api.repo_releases:
         print("Repo release {}: {}".format(release["id"], api.repo_release(release["id"])))
     
+    print("Connections: {}".format(api.pool.stats()))
+    
 if __name__ == "__main__":
     main()
@@ -0,0 +1,172 @@
+import os
+import re
+import json
+import hashlib
+
+SOURCES_LIST = "/etc/apt/sources.list"
+SOURCES_DIR = "/etc/apt/sources.list.d"
+CACHE_FILE = "/var/cache/tiliado-repositories/apt-sources.json"
+TEMP_SUFFIX = ".new.nuvola"
+
+_FIELD = re.compile(r"^([^\s#:][^:]*):(.*)$")
+
+def file_signature(stat):
+    return [stat.st_mtime_ns, stat.st_size, stat.st_ino]
+
+class SourcesScanner:
+    # Disables APT sources which match any of the patterns, in both the one-line format and the deb822 format of
+    # *.sources files. Files are matched as a whole with a single compiled alternation and only matching files
+    # are processed line by line. Signatures of files which contain no match are cached between runs.
+    def __init__(self, patterns, cache_file=CACHE_FILE, log=print, dry_run=False, sources_list=SOURCES_LIST,
+            sources_dir=SOURCES_DIR, exclude=()):
+        self.matcher = re.compile("|".join(re.escape(p) for p in patterns))
+        self.digest = hashlib.sha1("\n".join(sorted(patterns)).encode("utf-8")).hexdigest()
+        self.cache_file = cache_file
+        self.log = log
+        self.dry_run = dry_run
+        self.sources_list = sources_list
+        self.sources_dir = sources_dir
+        self.exclude = frozenset(exclude)
+        self.skipped = 0
+        self.scanned = 0
+    
+    def list_files(self):
+        files = []
+        try:
+            files.append((self.sources_list, os.stat(self.sources_list)))
+        except OSError:
+            pass
+        try:
+            with os.scandir(self.sources_dir) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        files.append((entry.path, entry.stat()))
+        except OSError:
+            pass
+        return files
+    
+    def scan(self):
+        cache = self._load_cache()
+        clean = {}
+        disabled = []
+        for filename, stat in self.list_files():
+            if filename.endswith(TEMP_SUFFIX):
+                if not self.dry_run:
+                    try:
+                        os.unlink(filename)
+                    except OSError:
+                        pass
+                continue
+            if filename in self.exclude:
+                continue
+            
+            signature = file_signature(stat)
+            if cache.get(filename) == signature:
+                self.skipped += 1
+                clean[filename] = signature
+                continue
+            
+            self.scanned += 1
+            try:
+                with open(filename, "rb") as f:
+                    text = f.read().decode("utf-8", errors="surrogateescape")
+            except OSError as e:
+                self.log("Failed to read file '%s'. %s" % (filename, e))
+                continue
+            
+            found = []
+            if self.matcher.search(text):
+                if filename.endswith(".sources"):
+                    text = self.disable_deb822(text, found)
+                else:
+                    text = self.disable_one_line(text, found)
+            if found:
+                disabled.extend((filename, entry) for entry in found)
+                if self.dry_run or not self._replace(filename, text):
+                    continue
+                try:
+                    signature = file_signature(os.stat(filename))
+                except OSError:
+                    continue
+            clean[filename] = signature
+        
+        if not self.dry_run:
+            self._save_cache(clean)
+        return disabled
+    
+    def disable_one_line(self, text, found):
+        lines = text.splitlines(True)
+        for index, line in enumerate(lines):
+            if not line.strip().startswith("#") and self.matcher.search(line):
+                found.append(line.rstrip())
+                lines[index] = "# " + line
+        return "".join(lines)
+    
+    def disable_deb822(self, text, found):
+        result = []
+        stanza = []
+        for line in text.splitlines(True) + [""]:
+            if line.strip():
+                stanza.append(line)
+                continue
+            if stanza:
+                result.extend(self._disable_stanza(stanza, found))
+                stanza = []
+            result.append(line)
+        return "".join(result)
+    
+    def _disable_stanza(self, lines, found):
+        fields = {}
+        name = None
+        for index, line in enumerate(lines):
+            if line.startswith("#"):
+                continue
+            match = _FIELD.match(line)
+            if match:
+                name = match.group(1).strip().lower()
+                fields[name] = [index, match.group(2).strip()]
+            elif name is not None and line[:1] in (" ", "\t"):
+                fields[name][1] += " " + line.strip()
+        
+        uris = fields.get("uris")
+        enabled = fields.get("enabled")
+        if uris is None or not self.matcher.search(uris[1]) or (enabled is not None and enabled[1].lower() == "no"):
+            return lines
+        
+        found.append("URIs: " + uris[1])
+        lines = list(lines)
+        if enabled is not None:
+            lines[enabled[0]] = "Enabled: no\n"
+        else:
+            if not lines[-1].endswith("\n"):
+                lines[-1] += "\n"
+            lines.append("Enabled: no\n")
+        return lines
+    
+    def _replace(self, filename, text):
+        new_filename = filename + TEMP_SUFFIX
+        try:
+            with open(new_filename, "wb") as f:
+                f.write(text.encode("utf-8", errors="surrogateescape"))
+            os.replace(new_filename, filename)
+            return True
+        except OSError as e:
+            self.log("Failed to replace file '%s' with '%s'. %s" % (filename, new_filename, e))
+            return False
+    
+    def _load_cache(self):
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return cache.get("files", {}) if cache.get("patterns") == self.digest else {}
+    
+    def _save_cache(self, files):
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            with open(self.cache_file + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"patterns": self.digest, "files": files}, f)
+            os.replace(self.cache_file + ".tmp", self.cache_file)
+        except OSError as e:
+            self.log("Failed to save cache of APT sources '%s'. %s" % (self.cache_file, e))
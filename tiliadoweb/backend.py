@@ -1,14 +1,35 @@
-import glob
 import os
 import sys
+import glob
 import subprocess
 from codecs import open
+from tiliadoweb.aptsources import SourcesScanner, SOURCES_DIR
+from tiliadoweb.signingkey import SigningKey, SigningKeyError
 
 def log(line):
     sys.stdout.write(line)
     sys.stdout.write("\n")
     sys.stdout.flush()
 
+def rpm_key_installed(key):
+    # RPM stores imported keys as gpg-pubkey-<short key id> packages.
+    try:
+        return subprocess.call(["rpm", "-q", "gpg-pubkey-" + key[-8:].lower()],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) == 0
+    except OSError:
+        return False
+
+def import_rpm_key(key, signing_key=None, dry_run=False):
+    if signing_key is None:
+        argv = ["rpm", "--import", "http://keyserver.ubuntu.com/pks/lookup?search=0x{}&op=get".format(key)]
+        exec_and_collects(argv, dry_run=dry_run)
+        return
+    if rpm_key_installed(signing_key.key):
+        log("+ [key {} already imported]".format(signing_key.key))
+        return
+    signing_key.armored()
+    exec_and_collects(["rpm", "--import", signing_key.path], dry_run=dry_run)
+
 def exec_and_collects(argv, dry_run=False):
     log("+ {}".format(argv))
     if dry_run:
@@ -19,12 +40,29 @@ def exec_and_collects(argv, dry_run=False):
 def write_file(filename, data, dry_run=False):
     log("+ [write '{}']\n{}".format(filename, data))
     if not dry_run:
-        with open(filename, "w", "utf-8", errors='surrogateescape') as f:
+        with open(filename + ".tmp", "w", "utf-8", errors='surrogateescape') as f:
             f.write(data)
+        os.replace(filename + ".tmp", filename)
     else:
         log("*** Dry run ***\n")
 
+def update_file(filename, data, dry_run=False):
+    # Returns whether the file has been changed.
+    try:
+        with open(filename, "r", "utf-8", errors='surrogateescape') as f:
+            if f.read() == data:
+                log("+ [unchanged '{}']".format(filename))
+                return False
+    except OSError:
+        pass
+    write_file(filename, data, dry_run=dry_run)
+    return True
+
 class BaseBackend:
+    # The full fingerprint of DEFAULT_KEY, which the downloaded key must match. Until it is filled in, the key
+    # is imported from the keyserver on every run as before.
+    DEFAULT_FINGERPRINT = None
+    
     def __init__(self, verify_ssl=True, dry_run=False):
         self.dry_run = dry_run
         self.verify_ssl = verify_ssl
@@ -32,11 +70,30 @@ class BaseBackend:
     def prepare(self):
         pass
     
+    def signing_key(self):
+        if self.DEFAULT_FINGERPRINT is None:
+            return None
+        signing_key = SigningKey(self.DEFAULT_FINGERPRINT, log=log, dry_run=self.dry_run)
+        if signing_key.key != self.DEFAULT_KEY:
+            raise SigningKeyError("Fingerprint {} is not the one of key {}.".format(signing_key.fingerprint,
+                self.DEFAULT_KEY))
+        return signing_key
+    
     def disable_conflicting_repositories(self, protocol, server, products):
-        pass
+        return []
+    
+    def has_metadata(self, server, products, dist_release, variants):
+        return False
+    
+    def repo_filter(self, products, variants):
+        if not products:
+            return []
+        return ["--disablerepo=*"] + ["--enablerepo={}-{}".format(product, variant)
+            for product in products for variant in variants]
 
 class DebBackend(BaseBackend):
     DEFAULT_KEY = "40554B8FA5FE6F6A"
+    LIST_FILE = os.path.join(SOURCES_DIR, "tiliado-{}.list")
     
     def __init__(self, *args, **kwargs):
         BaseBackend.__init__(self, *args, **kwargs)
@@ -48,7 +105,7 @@ class DebBackend(BaseBackend):
     def install_packages(self, packages):
             argv = ["apt-get", "install", "-y"] + self.apt_opts + packages
             exec_and_collects(argv, dry_run=self.dry_run)
-            
+    
     def remove_packages(self, packages):
         argv = ["apt-get", "remove", "-y"] + self.apt_opts + [pkg + "*" for pkg in packages]
         try:
@@ -63,54 +120,28 @@ class DebBackend(BaseBackend):
             pattern.format(server=server, project=product)
             for product in products
         ]
-        files = ["/etc/apt/sources.list"] + glob.glob("/etc/apt/sources.list.d/*")
-        for filename in (f for f in files if os.path.isfile(f)):
-            if filename.endswith(".new.nuvola"):
-                try:
-                    os.unlink(filename)
-                except Exception:
-                    pass
-                continue
-            
-            found = False
-            data = []
-            with open(filename, "r", encoding="utf-8", errors='surrogateescape') as f:
-                for line in f:
-                    if line.strip().startswith("#"):
-                        data.append(line)
-                    else:
-                        for match in find:
-                            if match in line:
-                                log("Disabled in file '%s':\n    %s" % (filename, line.rstrip()))
-                                data.append("# " + line)
-                                found = True
-                                break
-                        else:
-                            data.append(line)
-            if found:
-                new_filename = "%s.new.nuvola" % filename
-                data = "".join(data)
-                with open(new_filename, "w", encoding="utf-8", errors='surrogateescape') as f:
-                    f.write(data)
-                
-                try:
-                    os.replace(new_filename, filename)
-                except Exception as e:
-                    log("Failed to replace file '%s' with '%s'. %s" % (filename, new_filename, e))
-                   
+        # The lists of the products are managed by add_repositories.
+        own = [self.LIST_FILE.format(product) for product in products]
+        scanner = SourcesScanner(find, log=log, dry_run=self.dry_run, exclude=own)
+        disabled = scanner.scan()
+        for filename, line in disabled:
+            log("Disabled in file '%s':\n    %s" % (filename, line))
+        log("+ [scanned %d source files, %d unchanged files skipped]" % (scanner.scanned, scanner.skipped))
+        return disabled
+    
     def add_repositories(self, protocol, server, username, token, products, dist_release, variants):
         protocol = protocol or "https"
         variants = " ".join(variants)
-        sources_dir = "/etc/apt/sources.list.d"
-        log("+ [makedirs '{}']".format(sources_dir))
+        log("+ [makedirs '{}']".format(SOURCES_DIR))
         if not self.dry_run:
-            os.makedirs(sources_dir, exist_ok=True)
+            os.makedirs(SOURCES_DIR, exist_ok=True)
         
         arch = os.uname()[4]
         log("+ [arch '{}']".format(arch))
         auth = "{}:{}@".format(username, token) if username and token else ""
+        changed = []
         for product in products:
-            filename = "{}/tiliado-{}.list".format(sources_dir, product)
+            filename = self.LIST_FILE.format(product)
             apt_line = "deb {protocol}://{auth}{server}/{project}/repository/deb/ {release} {components} # {product} ({components})\n".format(
                 product=product,
                 server=server,
@@ -119,9 +150,27 @@ class DebBackend(BaseBackend):
                 project=product,
                 release=dist_release,
                 components=variants)
-            write_file(filename, apt_line, dry_run=self.dry_run)
+            if update_file(filename, apt_line, dry_run=self.dry_run):
+                changed.append(filename)
+        return changed
+    
+    def has_metadata(self, server, products, dist_release, variants):
+        # APT names the lists after the URI without credentials, e.g.
+        # tiliado.eu_nuvolaplayer_repository_deb_dists_bionic_stable_binary-amd64_Packages
+        lists = os.listdir("/var/lib/apt/lists") if os.path.isdir("/var/lib/apt/lists") else []
+        for product in products:
+            for variant in variants:
+                prefix = "{}_{}_repository_deb_dists_{}_{}_".format(server.replace("/", "_").replace(":", "%3a"), product, dist_release, variant)
+                if not any(name.startswith(prefix) and "Packages" in name for name in lists):
+                    return False
+        return True
+    
+    def add_key(self, signing_key):
+        if signing_key is None:
+            return self.import_key(self.DEFAULT_KEY)
+        signing_key.install("/etc/apt/trusted.gpg.d/tiliado-{}.gpg".format(signing_key.key.lower()))
     
-    def add_key(self, key):
+    def import_key(self, key):
         key_path = "/tmp/%s.gpg" % key
         rm_key = ["rm", "-fv", key_path]
         exec_and_collects(rm_key, dry_run=self.dry_run)
@@ -130,17 +179,27 @@ class DebBackend(BaseBackend):
         argv = ["apt-key", "add", key_path]
         exec_and_collects(argv, dry_run=self.dry_run)
         exec_and_collects(rm_key, dry_run=self.dry_run)
-        
     
-    def update_db(self):
+    def update_db(self, products=None, variants=None):
+        if products:
+            # Only the Tiliado lists are refreshed, lists of the other sources are kept as they are.
+            for product in products:
+                argv = ["apt-get", "update"] + self.apt_opts + [
+                    "-o", "Dir::Etc::sourcelist=" + self.LIST_FILE.format(product),
+                    "-o", "Dir::Etc::sourceparts=-",
+                    "-o", "APT::Get::List-Cleanup=0"]
+                exec_and_collects(argv, dry_run=self.dry_run)
+            return
+        
         argv = ["apt-get", "update"] + self.apt_opts
         try:
             exec_and_collects(argv, dry_run=self.dry_run)
         except subprocess.CalledProcessError as e:
-            log("\nWarning: Database update command failed, probably because of broken repositories in your APT sources lists. Error code:".format(e.returncode))
+            log("\nWarning: Database update command failed, probably because of broken repositories in your APT sources lists. Error code: {}".format(e.returncode))
 
 class YumBackend(BaseBackend):
     DEFAULT_KEY = "40554B8FA5FE6F6A"
+    METADATA_CACHE = ("/var/cache/yum/*/*/{}-{}/repomd.xml",)
     
     def __init__(self, *args, **kwargs):
         BaseBackend.__init__(self, *args, **kwargs)
@@ -152,7 +211,7 @@ class YumBackend(BaseBackend):
     def install_packages(self, packages):
             argv = ["yum", "install", "-y"] + self.yum_opts + packages
             exec_and_collects(argv, dry_run=self.dry_run)
-            
+    
     def remove_packages(self, packages):
         argv = ["yum", "remove", "-y"] + self.yum_opts + packages
         try:
@@ -176,6 +235,7 @@ class YumBackend(BaseBackend):
             arch = 'i686'
         
         auth = "{}:{}@".format(username, token) if username and token else ""
+        changed = []
         for product in products:
             buffer = []
             for component in variants:
@@ -192,18 +252,24 @@ class YumBackend(BaseBackend):
                 buffer.append('')
             
             filename = "{}/tiliado-{}.repo".format(sources_dir, product)
-            write_file(filename, "\n".join(buffer), dry_run=self.dry_run)
+            if update_file(filename, "\n".join(buffer), dry_run=self.dry_run):
+                changed.append(filename)
+        return changed
     
-    def add_key(self, key):
-        argv = ["rpm", "--import", "http://keyserver.ubuntu.com/pks/lookup?search=0x{}&op=get".format(key)]
-        exec_and_collects(argv, dry_run=self.dry_run)
+    def has_metadata(self, server, products, dist_release, variants):
+        return all(glob.glob(pattern.format(product, variant))
+            for product in products for variant in variants for pattern in self.METADATA_CACHE)
     
-    def update_db(self):
-        argv = ["yum", "makecache", "fast", "-y"] + self.yum_opts
+    def add_key(self, signing_key):
+        import_rpm_key(self.DEFAULT_KEY, signing_key, dry_run=self.dry_run)
+    
+    def update_db(self, products=None, variants=None):
+        argv = ["yum", "makecache", "fast", "-y"] + self.yum_opts + self.repo_filter(products, variants)
         exec_and_collects(argv, dry_run=self.dry_run)
 
 class DnfBackend(BaseBackend):
     DEFAULT_KEY = "40554B8FA5FE6F6A"
+    METADATA_CACHE = ("/var/cache/dnf/{}-{}-*/repodata/repomd.xml",)
     
     def __init__(self, *args, **kwargs):
         BaseBackend.__init__(self, *args, **kwargs)
@@ -215,7 +281,7 @@ class DnfBackend(BaseBackend):
     def install_packages(self, packages):
             argv = ["dnf", "install", "-y"] + self.dnf_opts + packages
             exec_and_collects(argv, dry_run=self.dry_run)
-            
+    
     def remove_packages(self, packages):
         argv = ["dnf", "remove", "-y"] + self.dnf_opts + [pkg + "*" for pkg in packages]
         try:
@@ -240,6 +306,7 @@ class DnfBackend(BaseBackend):
             arch = 'i686'
         
         auth = "{}:{}@".format(username, token) if username and token else ""
+        changed = []
         for product in products:
             buffer = []
             for component in variants:
@@ -256,18 +323,23 @@ class DnfBackend(BaseBackend):
                 buffer.append('')
             
             filename = "{}/tiliado-{}.repo".format(sources_dir, product)
-            write_file(filename, "\n".join(buffer), dry_run=self.dry_run)
+            if update_file(filename, "\n".join(buffer), dry_run=self.dry_run):
+                changed.append(filename)
+        return changed
     
-    def add_key(self, key):
-        argv = ["rpm", "--import", "http://keyserver.ubuntu.com/pks/lookup?search=0x{}&op=get".format(key)]
-        exec_and_collects(argv, dry_run=self.dry_run)
+    def has_metadata(self, server, products, dist_release, variants):
+        return all(glob.glob(pattern.format(product, variant))
+            for product in products for variant in variants for pattern in self.METADATA_CACHE)
+    
+    def add_key(self, signing_key):
+        import_rpm_key(self.DEFAULT_KEY, signing_key, dry_run=self.dry_run)
     
-    def update_db(self):
-        argv = ["dnf", "makecache", "--refresh", "-y"] + self.dnf_opts
+    def update_db(self, products=None, variants=None):
+        argv = ["dnf", "makecache", "--refresh", "-y"] + self.dnf_opts + self.repo_filter(products, variants)
         exec_and_collects(argv, dry_run=self.dry_run)
 
 def install(server, protocol, project, distribution, release, variants, username=None, token=None,
-    install=None, dry_run=False, no_verify_ssl=False, http_proxy=None, https_proxy=None, **kwd):
+    install=None, dry_run=False, no_verify_ssl=False, http_proxy=None, https_proxy=None, full_refresh=False, **kwd):
     if http_proxy is not None:
         os.environ["http_proxy"] = http_proxy
     if https_proxy is not None:
@@ -282,16 +354,25 @@ def install(server, protocol, project, distribution, release, variants, username
         sys.exit(2)
     
     try:
+        # The key is checked before any packages are removed.
+        signing_key = backend.signing_key()
         backend.prepare()
         
         if install:
             install = install.split(",")
             backend.remove_packages(install)
         
-        backend.add_key(backend.DEFAULT_KEY)
-        backend.disable_conflicting_repositories(protocol, server, project.split(","))
-        backend.add_repositories(protocol, server, username, token, project.split(","), release, variants.split(","))
-        backend.update_db()
+        backend.add_key(signing_key)
+        products = project.split(",")
+        variants = variants.split(",")
+        changed = backend.disable_conflicting_repositories(protocol, server, products)
+        changed = backend.add_repositories(protocol, server, username, token, products, release, variants) or changed
+        if full_refresh:
+            backend.update_db()
+        elif changed or not backend.has_metadata(server, products, release, variants):
+            backend.update_db(products, variants)
+        else:
+            log("+ [skipped metadata refresh: repository definitions are unchanged and their metadata is present]")
         
         if install:
             backend.install_packages(install)
@@ -303,6 +384,9 @@ def install(server, protocol, project, distribution, release, variants, username
     except OSError as e:
         log("OS Error: {}".format(e))
         sys.exit(3)
+    except SigningKeyError as e:
+        log("Signing key error: {}".format(e))
+        sys.exit(5)
 
 def main():
     import argparse
@@ -320,6 +404,8 @@ def main():
     parser.add_argument("--dry-run", action='store_true', default=False)
     parser.add_argument('-i', "--install", type=str)
     parser.add_argument('--no-verify-ssl', action="store_true", default=False)
+    parser.add_argument("--full-refresh", dest="full_refresh", action="store_true", default=False,
+        help="Refresh metadata of all repositories, not only of the Tiliado ones.")
     args = parser.parse_args()
     
     os.environ["LANG"] = "C.UTF-8"
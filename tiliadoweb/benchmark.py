@@ -0,0 +1,174 @@
+import json
+import time
+import multiprocessing
+import shutil
+import tempfile
+import tracemalloc
+
+from tiliadoweb.api import TiliadoApi, ApiError, TEST_USER
+from tiliadoweb.cache import ResponseCache
+from tiliadoweb.catalog import CatalogModel
+from tiliadoweb.connection import ConnectionPool
+from tiliadoweb.devserver import DevServer, SyntheticCatalog
+
+def wizard_flow(api):
+    # The data flow of the installer from switch_to_repositories to switch_to_products without the GUI.
+    repositories = [repo for repo in api.repositories if repo["active"]]
+    if not repositories:
+        return []
+    repo = repositories[0]
+    
+    components = api.components(repo.get("component_set", ()))
+    model = CatalogModel(api.groups, api.distributions, api.repo_releases)
+    index = model.repository(repo["id"], components)
+    access = index.access(api.me["groups"])
+    releases = sorted(name for (name, names) in access.items() if names)
+    if not releases:
+        return []
+    
+    release = releases[0]
+    components_id = [index.components_id[name] for name in access[release]]
+    package_index = api.package_index(repo["id"], model.releases_id[release])
+    return [p for p in api.list_products(repository=repo["id"]) if package_index.is_available(p, components_id)]
+
+def login_with_retries(api, attempts=3):
+    # Unlike GET requests, logging in is not retried by the API.
+    for attempt in range(attempts):
+        try:
+            return api.login(*TEST_USER)
+        except ApiError as e:
+            if not e.retryable or attempt + 1 >= attempts:
+                raise
+
+def measure(name, create_api, login=True, trace=False):
+    # Tracing slows Python down a lot, so that memory is measured in separate runs from wall time. A run which
+    # fails despite retries, e.g. with injected errors, is counted rather than aborting the benchmark.
+    api = create_api()
+    if trace:
+        tracemalloc.start()
+    started = time.perf_counter()
+    error = None
+    products = []
+    try:
+        if login:
+            login_with_retries(api)
+        products = wizard_flow(api)
+    except ApiError as e:
+        error = str(e)
+    elapsed = time.perf_counter() - started
+    peak = None
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    stats = api.pool.stats()
+    api.pool.close()
+    return {
+        "scenario": name,
+        "products": len(products),
+        "round_trips": stats["requests"],
+        "wall_time": None if trace or error else elapsed,
+        "peak_memory": peak,
+        "bytes_received": stats["bytes_received"],
+        "connections": stats["connections"],
+        "retries": api.retried,
+        "error": error,
+    }
+
+def serve(connection, catalog, options):
+    server = DevServer(("127.0.0.1", 0), SyntheticCatalog(**catalog), **options)
+    connection.send(server.url)
+    server.serve_forever()
+
+def start_server(catalog, options):
+    # The server runs in its own process, so that it neither competes for the GIL nor shows in traced memory.
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=serve, args=(child, catalog, options), daemon=True)
+    process.start()
+    return process, parent.recv()
+
+def run(server_url, runs=3, login=True):
+    cache_dir = tempfile.mkdtemp(prefix="tiliado-benchmark-")
+    try:
+        def cold():
+            return TiliadoApi(server_url, "api/", "api-auth/obtain-token/", pool=ConnectionPool())
+        
+        def cached():
+            return TiliadoApi(server_url, "api/", "api-auth/obtain-token/", pool=ConnectionPool(),
+                cache=ResponseCache(cache_dir))
+        
+        measure("warm-up", cached, login)  # Fills the cache for the cached scenario.
+        results = []
+        for scenario, create_api in (("cold", cold), ("cached", cached)):
+            for i in range(runs):
+                results.append(measure(scenario, create_api, login))
+            results.append(measure(scenario, create_api, login, trace=True))
+        return results
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+def summarize(results):
+    summary = {}
+    for result in results:
+        summary.setdefault(result["scenario"], []).append(result)
+    for scenario, runs in summary.items():
+        wall_times = sorted(r["wall_time"] for r in runs if r["wall_time"] is not None)
+        yield {
+            "scenario": scenario,
+            "runs": len(wall_times),
+            "failures": sum(1 for r in runs if r["error"]),
+            "retries": sum(r["retries"] for r in runs),
+            "round_trips": max(r["round_trips"] for r in runs),
+            "wall_time_min": wall_times[0] if wall_times else None,
+            "wall_time_median": wall_times[len(wall_times) // 2] if wall_times else None,
+            "peak_memory": max(r["peak_memory"] or 0 for r in runs),
+            "bytes_received": max(r["bytes_received"] for r in runs),
+            "products": runs[-1]["products"],
+        }
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark the installer data flow against a local API server.")
+    parser.add_argument("--server", type=str, default=None, help="Use a running server instead of a local one.")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--anonymous", action="store_true", default=False)
+    parser.add_argument("--repositories", type=int, default=3)
+    parser.add_argument("--releases", type=int, default=6)
+    parser.add_argument("--products", type=int, default=10)
+    parser.add_argument("--packages", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", dest="error_rate", type=float, default=0.0)
+    parser.add_argument("--json", action="store_true", default=False)
+    args = parser.parse_args()
+    
+    process = None
+    if args.server:
+        server_url = args.server
+    else:
+        catalog = {"repositories": args.repositories, "releases": args.releases, "products": args.products,
+            "packages": args.packages}
+        options = {"latency": args.latency, "jitter": args.jitter, "error_rate": args.error_rate}
+        process, server_url = start_server(catalog, options)
+    
+    try:
+        summary = list(summarize(run(server_url, args.runs, not args.anonymous)))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.join()
+    
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    for s in summary:
+        if not s["runs"]:
+            print("{scenario:<8} all {failures} runs failed".format(**s))
+            continue
+        print("{scenario:<8} round trips {round_trips:>4}  wall time {median:>8.1f} ms (min {min:.1f} ms)  "
+            "peak memory {memory:>8.1f} KiB  received {received:>8.1f} KiB  products {products}  "
+            "retries {retries}  failed runs {failures}".format(
+            median=s["wall_time_median"] * 1000, min=s["wall_time_min"] * 1000, memory=s["peak_memory"] / 1024,
+            received=s["bytes_received"] / 1024, **s))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+DEFAULT_MAX_SIZE = 16 * 1024 * 1024
+
+# Time to live in seconds, looked up by the longest matching prefix of the API path.
+DEFAULT_TTLS = {
+    "repository/repositories/": 3600,
+    "repository/components/": 3600,
+    "repository/releases/": 24 * 3600,
+    "repository/distributions/": 24 * 3600,
+    "repository/products/": 3600,
+    "repository/packages/": 600,
+    "auth/groups/": 24 * 3600,
+}
+
+class CacheEntry:
+    def __init__(self, url, stored, etag, last_modified, data, size):
+        self.url = url
+        self.stored = stored
+        self.etag = etag
+        self.last_modified = last_modified
+        self.data = data
+        self.size = size
+    
+    def is_fresh(self, ttl):
+        return time.time() - self.stored < ttl
+    
+    def conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+class ResponseCache:
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE, ttls=None):
+        self.directory = directory
+        self.max_size = max_size
+        self.ttls = DEFAULT_TTLS if ttls is None else ttls
+        self._entries = {}
+        self._sizes = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+    
+    def ttl(self, path):
+        path = path.split("?", 1)[0]
+        best = None
+        for prefix, ttl in self.ttls.items():
+            if path.startswith(prefix) and (best is None or len(prefix) > len(best)):
+                best = prefix
+        return self.ttls[best] if best is not None else None
+    
+    def key(self, url, username=None):
+        return hashlib.sha1("{}\n{}".format(username or "", url).encode("utf-8")).hexdigest()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            return entry
+        
+        filename = os.path.join(self.directory, key)
+        try:
+            with open(filename, "rb") as f:
+                meta = json.loads(f.readline().decode("utf-8"))
+                data = json.loads(f.read().decode("utf-8"))
+            size = os.path.getsize(filename)
+        except (OSError, ValueError):
+            return None
+        
+        entry = CacheEntry(meta["url"], meta["stored"], meta.get("etag"), meta.get("last_modified"), data, size)
+        with self._lock:
+            return self._entries.setdefault(key, entry)
+    
+    def store(self, key, url, headers, body, data):
+        entry = CacheEntry(url, time.time(), headers.get("ETag"), headers.get("Last-Modified"), data, 0)
+        meta = {"url": url, "stored": entry.stored, "etag": entry.etag, "last_modified": entry.last_modified}
+        blob = json.dumps(meta).encode("utf-8") + b"\n" + body
+        entry.size = len(blob)
+        if entry.size > self.max_size:
+            return entry
+        
+        filename = os.path.join(self.directory, key)
+        try:
+            with open(filename + ".tmp", "wb") as f:
+                f.write(blob)
+            os.replace(filename + ".tmp", filename)
+        except OSError as e:
+            print("Failed to store cache entry for {}: {}".format(url, e))
+            return entry
+        
+        with self._lock:
+            self._entries[key] = entry
+            sizes = self._get_sizes()
+            sizes.pop(key, None)
+            sizes[key] = entry.size
+        self._evict()
+        return entry
+    
+    def touch(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry.stored = time.time()
+            sizes = self._get_sizes()
+            if key in sizes:
+                sizes[key] = sizes.pop(key)
+        
+        filename = os.path.join(self.directory, key)
+        meta = {"url": entry.url, "stored": entry.stored, "etag": entry.etag, "last_modified": entry.last_modified}
+        try:
+            with open(filename, "rb") as f:
+                f.readline()
+                body = f.read()
+            with open(filename + ".tmp", "wb") as f:
+                f.write(json.dumps(meta).encode("utf-8") + b"\n" + body)
+            os.replace(filename + ".tmp", filename)
+        except OSError as e:
+            print("Failed to refresh cache entry for {}: {}".format(entry.url, e))
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            sizes = self._get_sizes()
+            keys = list(sizes)
+            sizes.clear()
+        for key in keys:
+            self._remove_file(key)
+    
+    def _get_sizes(self):
+        # Insertion order of the dict is the eviction order, least recently stored first.
+        if self._sizes is None:
+            files = []
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, name, stat.st_size))
+            self._sizes = {name: size for (mtime, name, size) in sorted(files)}
+        return self._sizes
+    
+    def _evict(self):
+        removed = []
+        with self._lock:
+            sizes = self._get_sizes()
+            total = sum(sizes.values())
+            while total > self.max_size and sizes:
+                key = next(iter(sizes))
+                total -= sizes.pop(key)
+                self._entries.pop(key, None)
+                removed.append(key)
+        for key in removed:
+            self._remove_file(key)
+    
+    def _remove_file(self, key):
+        try:
+            os.unlink(os.path.join(self.directory, key))
+        except OSError:
+            pass
@@ -0,0 +1,91 @@
+from collections import namedtuple
+
+Release = namedtuple("Release", "name distribution label components")
+Component = namedtuple("Component", "name label desc groups")
+
+class PackageIndex:
+    def __init__(self, repository, release, components=None):
+        self.repository = repository
+        self.release = release
+        self.components = components if components is not None else {}
+    
+    def __eq__(self, other):
+        return isinstance(other, PackageIndex) and (self.repository, self.release, self.components) == (
+            other.repository, other.release, other.components)
+    
+    @classmethod
+    def from_packages(cls, repository, release, packages):
+        index = cls(repository, release)
+        for package in packages:
+            index.add(package["name"], package["component"])
+        return index
+    
+    def add(self, name, component):
+        try:
+            self.components[name].add(component)
+        except KeyError:
+            self.components[name] = {component}
+    
+    def has_package(self, name, components):
+        found = self.components.get(name)
+        return bool(found) and not found.isdisjoint(components)
+    
+    def is_available(self, product, components):
+        return all(self.has_package(name, components) for name in product["packages"].split(","))
+
+class CatalogModel:
+    # Indexes of groups, distributions and releases, built once for each version of these collections. The API
+    # memo and the snapshot return the same objects until the data changes.
+    def __init__(self, groups, distributions, releases):
+        self.sources = (groups, distributions, releases)
+        self.group_names = {g["id"]: g["name"] for g in groups}
+        distributions = {d["id"]: d for d in distributions}
+        self.releases = {}
+        for r in releases:
+            distribution = distributions[r["distribution"]]
+            self.releases[r["id"]] = (r["name"], distribution["name"], "{} {}".format(distribution["label"], r["label"]))
+        self.releases_id = {name: r_id for (r_id, (name, dist, label)) in self.releases.items()}
+        self.releases_dists = {name: dist for (name, dist, label) in self.releases.values()}
+        self._repositories = {}
+    
+    def is_current(self, groups, distributions, releases):
+        return all(a is b for (a, b) in zip(self.sources, (groups, distributions, releases)))
+    
+    def repository(self, repo_id, components):
+        key = tuple(id(c) for c in components)
+        index = self._repositories.get(repo_id)
+        if index is None or index.key != key:
+            index = self._repositories[repo_id] = RepositoryIndex(self, components, key)
+        return index
+
+class RepositoryIndex:
+    def __init__(self, model, components, key):
+        self.key = key
+        self.components = components  # Keeps the ids in the key valid.
+        self.components_id = {}
+        releases = {}
+        for c in components:
+            if c["active"]:
+                self.components_id[c["name"]] = c["id"]
+                for access in c["access_set"]:
+                    if access["release"] in model.releases:
+                        groups = {g: model.group_names[g] for g in access["groups"]}
+                        component = Component(c["name"], c["label"], c["desc"], groups)
+                        releases.setdefault(access["release"], {})[c["name"]] = component
+        
+        self.options = {}
+        for r_id, release_components in releases.items():
+            name, dist, label = model.releases[r_id]
+            self.options[name] = Release(name, dist, label, release_components)
+        self._access = {}
+    
+    def access(self, user_groups):
+        # Names of components the user can access in each release, computed once per set of user groups.
+        user_groups = frozenset(user_groups)
+        masks = self._access.get(user_groups)
+        if masks is None:
+            masks = self._access[user_groups] = {
+                name: frozenset(c.name for c in release.components.values() if not user_groups.isdisjoint(c.groups))
+                for (name, release) in self.options.items()
+            }
+        return masks
@@ -3,6 +3,8 @@ PASSWORD_RESET_PATH = "accounts/password/reset/"
 API_PATH = "api/"
 API_AUTH = "api-auth/obtain-token/"
 VERIFY_SSL = True
+API_TIMEOUT = 20
+STEP_TIMEOUT = 60
 
 def _join_config():
     import sys
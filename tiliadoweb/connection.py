@@ -0,0 +1,235 @@
+import http.client
+import ssl
+import threading
+import time
+import zlib
+from base64 import b64encode
+from urllib.parse import urlsplit, unquote
+from urllib.request import getproxies, proxy_bypass
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+ACCEPT_ENCODING = "gzip, deflate"
+
+# Errors raised when a kept-alive connection has been closed by the server in the meantime.
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine, BrokenPipeError,
+    ConnectionResetError, ConnectionAbortedError)
+
+class PooledResponse:
+    def __init__(self, pool, key, connection, response, started, on_close=None):
+        self.pool = pool
+        self.key = key
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self.data = None
+        self.received = 0
+        self.decoded = 0
+        self._connection = connection
+        self._response = response
+        self._started = started
+        self._on_close = on_close
+        self._encoding = response.headers.get("Content-Encoding", "identity").lower()
+        if self._encoding in ("gzip", "x-gzip"):
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self._encoding == "deflate":
+            self._decompressor = zlib.decompressobj()
+        else:
+            self._decompressor = None
+    
+    def read(self):
+        if self.data is None:
+            try:
+                self.data = self._decode(self._response.read(), True)
+            finally:
+                self.close()
+        return self.data
+    
+    def iter_chunks(self, size=64 * 1024):
+        try:
+            while True:
+                raw = self._response.read(size)
+                chunk = self._decode(raw, not raw)
+                if chunk:
+                    yield chunk
+                if not raw:
+                    break
+        finally:
+            self.close()
+    
+    def _decode(self, chunk, final):
+        self.received += len(chunk)
+        decompressor = self._decompressor
+        if decompressor is not None:
+            try:
+                data = decompressor.decompress(chunk)
+            except zlib.error:
+                if self._encoding != "deflate" or self.decoded or self.received != len(chunk):
+                    raise
+                # Some servers send raw deflate data without the zlib wrapper.
+                decompressor = self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                data = decompressor.decompress(chunk)
+            chunk = data + decompressor.flush() if final else data
+        self.decoded += len(chunk)
+        return chunk
+    
+    def close(self):
+        connection, self._connection = self._connection, None
+        if connection is None:
+            return
+        
+        elapsed = time.monotonic() - self._started
+        self.pool._record(self.received, self.decoded, elapsed)
+        if self._on_close is not None:
+            self._on_close(self, elapsed)
+        response = self._response
+        if response.isclosed() and not response.will_close:
+            self.pool._release(self.key, connection)
+        else:
+            response.close()
+            connection.close()
+
+class ConnectionPool:
+    def __init__(self, max_idle=4, timeout=None, verify_ssl=True):
+        self.max_idle = max_idle
+        self.timeout = timeout
+        if verify_ssl:
+            self.ssl_context = ssl.create_default_context()
+        else:
+            self.ssl_context = ssl._create_unverified_context()
+        self._idle = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.reused = 0
+        self.reconnects = 0
+        self.bytes_received = 0
+        self.bytes_decoded = 0
+        self.time = 0.0
+    
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "connections": self.connections,
+                "reused": self.reused,
+                "reconnects": self.reconnects,
+                "bytes_received": self.bytes_received,
+                "bytes_decoded": self.bytes_decoded,
+                "time": self.time,
+                "idle": sum(len(idle) for idle in self._idle.values()),
+            }
+    
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+    
+    def request(self, method, url, body=None, headers=None, timeout=None, on_close=None):
+        response = self.open(method, url, body, headers, timeout, on_close)
+        response.read()
+        return response
+    
+    def open(self, method, url, body=None, headers=None, timeout=None, on_close=None):
+        parts = urlsplit(url)
+        scheme = parts.scheme
+        host = parts.hostname
+        port = parts.port or DEFAULT_PORTS[scheme]
+        path = parts.path or "/"
+        if parts.query:
+            path = "{}?{}".format(path, parts.query)
+        
+        headers = dict(headers or {})
+        headers.setdefault("Accept-Encoding", ACCEPT_ENCODING)
+        proxy = self._get_proxy(scheme, host)
+        if proxy and scheme == "http":
+            # Plain HTTP goes through the proxy with an absolute URI, HTTPS is tunnelled with CONNECT.
+            path = "http://{}:{}{}".format(host, port, path)
+            if proxy[2]:
+                headers["Proxy-Authorization"] = proxy[2]
+        
+        key = (scheme, host, port, proxy)
+        started = time.monotonic()
+        connection, reused = self._acquire(key)
+        try:
+            response = self._send(connection, method, path, body, headers, timeout)
+        except STALE_CONNECTION_ERRORS:
+            connection.close()
+            if not reused:
+                raise
+            with self._lock:
+                self.reconnects += 1
+            connection = self._connect(key)
+            try:
+                response = self._send(connection, method, path, body, headers, timeout)
+            except BaseException:
+                connection.close()
+                raise
+        except BaseException:
+            connection.close()
+            raise
+        
+        with self._lock:
+            self.requests += 1
+        return PooledResponse(self, key, connection, response, started, on_close)
+    
+    def _send(self, connection, method, path, body, headers, timeout):
+        connection.timeout = self.timeout if timeout is None else timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(connection.timeout)
+        connection.request(method, path, body, headers)
+        return connection.getresponse()
+    
+    def _record(self, received, decoded, elapsed):
+        with self._lock:
+            self.bytes_received += received
+            self.bytes_decoded += decoded
+            self.time += elapsed
+    
+    def _get_proxy(self, scheme, host):
+        proxy = getproxies().get(scheme)
+        if not proxy or proxy_bypass(host):
+            return None
+        
+        parts = urlsplit(proxy if "://" in proxy else "http://" + proxy)
+        auth = None
+        if parts.username:
+            credentials = "{}:{}".format(unquote(parts.username), unquote(parts.password or ""))
+            auth = "Basic " + b64encode(credentials.encode("utf-8")).decode("ascii")
+        return parts.hostname, parts.port or DEFAULT_PORTS.get(parts.scheme, 80), auth
+    
+    def _acquire(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                self.reused += 1
+                return idle.pop(), True
+        return self._connect(key), False
+    
+    def _release(self, key, connection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+    
+    def _connect(self, key):
+        scheme, host, port, proxy = key
+        if proxy:
+            proxy_host, proxy_port, auth = proxy
+            if scheme == "https":
+                connection = http.client.HTTPSConnection(proxy_host, proxy_port, timeout=self.timeout,
+                    context=self.ssl_context)
+                connection.set_tunnel(host, port, {"Proxy-Authorization": auth} if auth else None)
+            else:
+                connection = http.client.HTTPConnection(proxy_host, proxy_port, timeout=self.timeout)
+        elif scheme == "https":
+            connection = http.client.HTTPSConnection(host, port, timeout=self.timeout, context=self.ssl_context)
+        else:
+            connection = http.client.HTTPConnection(host, port, timeout=self.timeout)
+        
+        with self._lock:
+            self.connections += 1
+        return connection
@@ -0,0 +1,258 @@
+import gzip
+import json
+import random
+import hashlib
+import threading
+import time
+from base64 import b64decode
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+from tiliadoweb.api import TEST_USER
+
+API_PATH = "/api/"
+API_AUTH = "/api-auth/obtain-token/"
+# Collections served in pages like {"results": [...], "next": "<url>"}, the rest are plain JSON arrays.
+PAGINATED = ("repository/packages/",)
+COMPONENTS = ("stable", "hotfix", "beta", "devel")
+DISTRIBUTIONS = (
+    ("ubuntu", "Ubuntu", ("xenial", "bionic", "focal", "jammy", "noble")),
+    ("debian", "Debian", ("stretch", "buster", "bullseye", "bookworm")),
+    ("fedora", "Fedora", ("fc37", "fc38", "fc39", "fc40")),
+)
+
+class SyntheticCatalog:
+    # A deterministic catalog with the same shape as the data of the real API.
+    def __init__(self, repositories=3, releases=6, products=10, packages=2000, seed=0):
+        rng = random.Random(seed)
+        self.groups = [{"id": 1, "name": "Everyone"}, {"id": 2, "name": "Patrons"}, {"id": 3, "name": "Developers"}]
+        
+        self.distributions = []
+        self.releases = []
+        for dist_id, (name, label, names) in enumerate(DISTRIBUTIONS, 1):
+            self.distributions.append({"id": dist_id, "name": name, "label": label})
+            for name in names:
+                if len(self.releases) < releases:
+                    release_id = len(self.releases) + 1
+                    self.releases.append({"id": release_id, "name": name, "label": name.capitalize(),
+                        "distribution": dist_id})
+        
+        self.repositories = []
+        self.components = []
+        self.products = []
+        self.packages = []
+        for repo_id in range(1, repositories + 1):
+            component_set = []
+            for index, name in enumerate(COMPONENTS):
+                component_id = len(self.components) + 1
+                component_set.append(component_id)
+                groups = [1] if index == 0 else [2, 3] if index < 3 else [3]
+                self.components.append({
+                    "id": component_id, "name": name, "label": name.capitalize(), "active": True,
+                    "desc": "The {} component of repository {}.".format(name, repo_id),
+                    "access_set": [{"release": r["id"], "groups": groups} for r in self.releases],
+                })
+            self.repositories.append({"id": repo_id, "name": "repo{}".format(repo_id),
+                "label": "Repository {}".format(repo_id), "project": "project{}".format(repo_id), "active": True,
+                "component_set": component_set})
+            
+            names = ["repo{}-package{}".format(repo_id, i) for i in range(max(1, packages // repositories))]
+            for product in range(products):
+                self.products.append({"id": len(self.products) + 1, "repository": repo_id,
+                    "name": "Product {}.{}".format(repo_id, product),
+                    "packages": ",".join(rng.sample(names, min(len(names), rng.randint(1, 3))))})
+            for name in names:
+                for release in self.releases:
+                    for component_id in component_set:
+                        if rng.random() < 0.8:
+                            self.packages.append({"id": len(self.packages) + 1, "name": name,
+                                "repository": repo_id, "release": release["id"], "component": component_id})
+    
+    def collections(self):
+        return {
+            "repository/repositories/": self.repositories,
+            "repository/components/": self.components,
+            "repository/releases/": self.releases,
+            "repository/distributions/": self.distributions,
+            "repository/products/": self.products,
+            "repository/packages/": self.packages,
+            "auth/groups/": self.groups,
+        }
+
+class DevServer(ThreadingHTTPServer):
+    daemon_threads = True
+    
+    def __init__(self, address=("127.0.0.1", 8000), catalog=None, users=None, latency=0.0, jitter=0.0,
+            error_rate=0.0, page_size=500, compress=True, seed=0):
+        ThreadingHTTPServer.__init__(self, address, DevRequestHandler)
+        self.catalog = catalog or SyntheticCatalog()
+        self.collections = self.catalog.collections()
+        self.users = dict(users or (TEST_USER,))
+        self.tokens = {}
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.page_size = page_size
+        self.compress = compress
+        self.random = random.Random(seed)
+        self.requests = 0
+        self._lock = threading.Lock()
+    
+    @property
+    def url(self):
+        return "http://{}:{}/".format(*self.server_address[:2])
+    
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+    
+    def delay(self):
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            failed = self.random.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        return failed
+    
+    def obtain_token(self, username, password):
+        if not username or self.users.get(username) != password:
+            return None
+        token = hashlib.sha1("{}:{}".format(username, password).encode("utf-8")).hexdigest()
+        self.tokens[token] = username
+        return token
+    
+    def authenticate(self, header):
+        # Authorization: Token base64(username) token
+        try:
+            kind, username, token = header.split()
+            username = b64decode(username).decode("utf-8")
+        except ValueError:
+            return None
+        return username if kind == "Token" and self.tokens.get(token) == username else None
+    
+    def query(self, path, params, user):
+        if path == "me/":
+            return {"username": user, "groups": [1, 2] if user else [1]}
+        
+        for prefix, items in self.collections.items():
+            if path == prefix:
+                for key, value in params.items():
+                    if key != "page":
+                        items = [i for i in items if str(i.get(key)) == value]
+                return items
+            if path.startswith(prefix):
+                try:
+                    key = int(path[len(prefix):].rstrip("/"))
+                except ValueError:
+                    return None
+                for item in items:
+                    if item["id"] == key:
+                        return item
+                return None
+        return None
+
+class DevRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in a single write, the response is flushed after each request.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.server.delay():
+            return self.send_json({"detail": "Injected error."}, 503)
+        if urlsplit(self.path).path != API_AUTH:
+            return self.send_json({"detail": "Not found."}, 404)
+        form = dict(parse_qsl(data.decode("utf-8")))
+        token = self.server.obtain_token(form.get("username"), form.get("password"))
+        if token is None:
+            return self.send_json({"non_field_errors": ["Unable to login with provided credentials."]}, 400)
+        self.send_json({"token": token})
+    
+    def do_GET(self):
+        if self.server.delay():
+            return self.send_json({"detail": "Injected error."}, 503)
+        
+        parts = urlsplit(self.path)
+        if not parts.path.startswith(API_PATH):
+            return self.send_json({"detail": "Not found."}, 404)
+        
+        user = None
+        header = self.headers.get("Authorization")
+        if header:
+            user = self.server.authenticate(header)
+            if user is None:
+                return self.send_json({"detail": "Invalid token."}, 401)
+        
+        params = dict(parse_qsl(parts.query))
+        path = parts.path[len(API_PATH):]
+        data = self.server.query(path, params, user)
+        if data is None:
+            return self.send_json({"detail": "Not found."}, 404)
+        
+        page_size = self.server.page_size
+        if path in PAGINATED and isinstance(data, list) and page_size and ("page" in params or len(data) > page_size):
+            page = int(params.get("page", 1))
+            start = (page - 1) * page_size
+            next_url = None
+            if start + page_size < len(data):
+                params["page"] = page + 1
+                next_url = "{}?{}".format(parts.path, urlencode(params))
+            data = {"count": len(data), "next": next_url, "previous": None, "results": data[start:start + page_size]}
+        self.send_json(data)
+    
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode("utf-8")
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if status == 200:
+            self.send_header("ETag", etag)
+        if self.server.compress and "gzip" in self.headers.get("Accept-Encoding", "") and len(body) > 1024:
+            body = gzip.compress(body, 1)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Local stand-in for the Tiliado API.")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--repositories", type=int, default=3)
+    parser.add_argument("--releases", type=int, default=6)
+    parser.add_argument("--products", type=int, default=10, help="Products per repository.")
+    parser.add_argument("--packages", type=int, default=2000, help="Package names in total.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Delay of each request in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random extra delay in seconds.")
+    parser.add_argument("--error-rate", dest="error_rate", type=float, default=0.0)
+    parser.add_argument("--page-size", dest="page_size", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    
+    catalog = SyntheticCatalog(args.repositories, args.releases, args.products, args.packages, args.seed)
+    server = DevServer((args.host, args.port), catalog, latency=args.latency, jitter=args.jitter,
+        error_rate=args.error_rate, page_size=args.page_size, seed=args.seed)
+    print("Serving {} packages at {}".format(len(catalog.packages), server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
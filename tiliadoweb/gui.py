@@ -1,21 +1,55 @@
-from gi.repository import Gtk, GLib
+from gi.repository import Gtk, GLib, GObject
 from collections import namedtuple
 import os
+import re
 
 escape_text = GLib.markup_escape_text
 
+# The token is passed to the backend as "-t <token>" and appears in repository URLs as "user:token@".
+_TOKEN_ARG = re.compile(r"""((?<![\w-])(?:-t|--token)['"]?(?:,\s*|\s+|=)['"]?)[^\s'",\]]+""")
+_URL_PASSWORD = re.compile(r"(://[^/\s:@]+:)[^/\s@]+@")
+
+def redact(text):
+    return _URL_PASSWORD.sub(r"\1***@", _TOKEN_ARG.sub(r"\1***", text))
+
 Option = namedtuple("Option", "name button label error")
 
 class Page(Gtk.Grid):
     def __init__(self, header):
         Gtk.Grid.__init__(self, expand=True, margin=10, orientation=Gtk.Orientation.VERTICAL, row_spacing=15, hexpand=True, vexpand=True)
-        self.header = Gtk.Label(label="<big><b>%s</b></big>" % header, use_markup=True, hexpand=True, vexpand=False, margin_top=15)
+        self.header = Gtk.Label(label="<big><b>%s</b></big>" % header, use_markup=True, vexpand=False)
+        self.spinner = Gtk.Spinner(no_show_all=True)
+        self.title = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=10, hexpand=True, halign=Gtk.Align.CENTER, margin_top=15)
+        self.title.add(self.header)
+        self.title.add(self.spinner)
         self.body = Gtk.Grid(row_spacing=10, column_spacing=10, hexpand=True, vexpand=True, valign=Gtk.Align.CENTER, halign=Gtk.Align.CENTER)
         self.buttons = Gtk.ButtonBox(orientation=Gtk.Orientation.HORIZONTAL, layout_style=Gtk.ButtonBoxStyle.EDGE, hexpand=True, vexpand=False)
-        self.attach(self.header, 0, 0, 1, 1)
+        self.attach(self.title, 0, 0, 1, 1)
         self.attach(self.body, 0, 1, 1, 1)
         self.attach(self.buttons, 0, 2, 1, 1)
         self.line = 0
+        self._buttons_sensitive = None
+    
+    def set_busy(self, busy):
+        # Only Back and Quit stay usable while the next step is loading.
+        if busy == (self._buttons_sensitive is not None):
+            return
+        self.spinner.set_visible(busy)
+        if busy:
+            self.spinner.start()
+        else:
+            self.spinner.stop()
+        self.body.set_sensitive(not busy)
+        if busy:
+            self._buttons_sensitive = {}
+            for button in self.buttons.get_children():
+                if button not in (getattr(self, "back_button", None), getattr(self, "quit_button", None)):
+                    self._buttons_sensitive[button] = button.get_sensitive()
+                    button.set_sensitive(False)
+        else:
+            for button, sensitive in self._buttons_sensitive.items():
+                button.set_sensitive(sensitive)
+            self._buttons_sensitive = None
     
     def add_row(self, widget1, widget2=None):
         if widget2 is None:
@@ -90,6 +124,10 @@ class LoginPage(Page):
                 w.set_visible(visible)
 
 class RepositoriesPage(Page):
+    __gsignals__ = {
+        "selection-changed": (GObject.SignalFlags.RUN_FIRST, None, ()),
+    }
+    
     def __init__(self):
         Page.__init__(self, "Tiliado Repositories")
         
@@ -99,6 +137,14 @@ class RepositoriesPage(Page):
         self.buttons.add(self.ok_button)
         self.repo = None
         self.ok_button.set_sensitive(False)
+        
+        self.status = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=10, halign=Gtk.Align.CENTER, no_show_all=True)
+        self.status_label = Gtk.Label(label="", wrap=True, justify=Gtk.Justification.CENTER, visible=True)
+        self.status.add(self.status_label)
+        self.refresh_button = Gtk.Button.new_with_label("Refresh")
+        self.status.add(self.refresh_button)
+        self.insert_row(1)
+        self.attach(self.status, 0, 1, 1, 1)
         self.show_all()
     
     def clear(self):
@@ -106,7 +152,17 @@ class RepositoriesPage(Page):
         self.repo = None
         self.ok_button.set_sensitive(False)
     
-    def set_repositories(self, repositories):
+    def set_busy(self, busy):
+        Page.set_busy(self, busy)
+        self.status.set_sensitive(not busy)
+    
+    def set_status(self, text=None, refresh=False):
+        self.status_label.set_text(text or "")
+        self.refresh_button.set_visible(refresh)
+        self.refresh_button.set_sensitive(True)
+        self.status.set_visible(bool(text or refresh))
+    
+    def set_repositories(self, repositories, selected=None):
         self.repositories = repositories
         self.clear()
         self.ok_button.set_sensitive(False)
@@ -124,6 +180,8 @@ class RepositoriesPage(Page):
                 self.repo = repo
                 self.ok_button.set_sensitive(True)
                 button.set_active(True)
+            elif repo["id"] == selected:
+                button.set_active(True)
         
             self.add_row(button)
             button.show()
@@ -132,8 +190,13 @@ class RepositoriesPage(Page):
         if button.get_active():
             self.repo = self.repositories[index]
             self.ok_button.set_sensitive(True)
+            self.emit("selection-changed")
 
 class ComponentsPage(Page):
+    __gsignals__ = {
+        "selection-changed": (GObject.SignalFlags.RUN_FIRST, None, ()),
+    }
+    
     def __init__(self, dist=None):
         Page.__init__(self, "Components")
         
@@ -172,15 +235,10 @@ class ComponentsPage(Page):
         self.ok_button.set_sensitive(False)
     
     def can_access(self, component):
-        groups = component.groups
-        for group in self.user_groups:
-            if group in groups:
-                return True
-        
-        return False
+        return component.name in self.access.get(self.dist, ())
         
-    def set_data(self, user_groups, options):
-        self.user_groups = user_groups
+    def set_data(self, access, options):
+        self.access = access
         self.options = options
         self.clear()
         self.ok_button.set_sensitive(False)
@@ -280,11 +338,13 @@ class ComponentsPage(Page):
     def on_dist_entry_changed(self, combobox):
         self.dist = combobox.get_active_id()
         self._update_options()
+        self.emit("selection-changed")
             
     def on_button_toggled(self, button, key):
         if button.get_active():
             self.enabled_components.clear()
             self.enabled_components.add(key)
+            self.emit("selection-changed")
         
         self._update_ok_button()
 
@@ -375,7 +435,7 @@ class SummaryPage(Page):
         self.show_all()
 
 class ProgressPage(Page):
-    def __init__(self, ):
+    def __init__(self, max_lines=5000, log_path=None):
         Page.__init__(self, "Installation progress")
         self.body.set_vexpand(True)
         self.body.set_hexpand(True)
@@ -386,9 +446,16 @@ class ProgressPage(Page):
         self.add_row(self.message)
         self.output = Gtk.TextView(vexpand=True, hexpand=True, editable=False)
         self.buffer = self.output.get_buffer()
-        scroll = Gtk.ScrolledWindow(vexpand=True, hexpand=True)
-        scroll.add(self.output)
-        self.add_row(scroll)
+        self.end_mark = self.buffer.create_mark(None, self.buffer.get_end_iter(), False)
+        self.scroll = Gtk.ScrolledWindow(vexpand=True, hexpand=True)
+        self.scroll.add(self.output)
+        self.add_row(self.scroll)
+        self.max_lines = max_lines
+        self.log_path = log_path
+        self.log = None
+        self.truncated = False
+        self._pending = []
+        self._tick_id = None
         
         self.back_button = Gtk.Button.new_with_label("Back")
         self.buttons.add(self.back_button)
@@ -400,15 +467,56 @@ class ProgressPage(Page):
     def clear(self):
         self.set_message("Installation is in progress...")
         self.buffer.set_text("")
+        self._pending = []
+        self.truncated = False
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+        if self.log_path:
+            try:
+                fd = os.open(self.log_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                os.fchmod(fd, 0o600)
+                self.log = open(fd, "w", encoding="utf-8", errors="backslashreplace")
+            except OSError as e:
+                print("Failed to open log file {}: {}".format(self.log_path, e))
     
     def write(self, data):
+        # Writes are coalesced and rendered at most once per frame. The full log goes to a file.
+        data = redact(data)
+        if self.log is not None:
+            self.log.write(data)
+        self._pending.append(data)
+        if self._tick_id is None:
+            self._tick_id = self.output.add_tick_callback(self._on_tick)
+    
+    def _on_tick(self, widget, frame_clock):
+        self._tick_id = None
+        self.flush()
+        return GLib.SOURCE_REMOVE
+    
+    def flush(self):
+        if self._tick_id is not None:
+            self.output.remove_tick_callback(self._tick_id)
+            self._tick_id = None
+        if self.log is not None:
+            self.log.flush()
+        if not self._pending:
+            return
+        
+        data = "".join(self._pending)
+        self._pending = []
+        adjustment = self.scroll.get_vadjustment()
+        at_bottom = adjustment.get_value() + adjustment.get_page_size() >= adjustment.get_upper() - 1
         buf = self.buffer
-        end = buf.get_end_iter()
-        buf.insert(end, data)
-        end = buf.get_end_iter()
-        self.output.scroll_to_iter(end, 0.0, False, 0, 0);
-        while Gtk.events_pending():
-            Gtk.main_iteration()
+        buf.insert(buf.get_end_iter(), data)
+        
+        # Only the tail is kept in the widget.
+        excess = buf.get_line_count() - self.max_lines
+        if excess > 0:
+            buf.delete(buf.get_start_iter(), buf.get_iter_at_line(excess))
+            self.truncated = True
+        if at_bottom:
+            self.output.scroll_to_mark(self.end_mark, 0.0, False, 0, 0)
     
     def set_message(self, text=None):
         if text:
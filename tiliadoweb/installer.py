@@ -1,28 +1,41 @@
 import os
 import sys
 import json
-from urllib.error import HTTPError
-from queue import Queue, Empty
+from concurrent.futures import ThreadPoolExecutor
 from gi.repository import Gtk, GLib
-from tiliadoweb.config import PROTOCOL, HOST, VERIFY_SSL
-from tiliadoweb.api import ApiError
-from tiliadoweb.worker import run_command
+from tiliadoweb.config import PROTOCOL, HOST, VERIFY_SSL, STEP_TIMEOUT
+from tiliadoweb.api import ApiError, ServerError
+from tiliadoweb.worker import run_command, WakeupQueue
+from tiliadoweb.snapshot import CatalogSnapshot
+from tiliadoweb.prefetch import Prefetcher
+from tiliadoweb.offline import OfflineApi
+from tiliadoweb.tasks import TaskRunner
+from tiliadoweb.catalog import CatalogModel
 
 CONFIG_FILENAME = "config2.json"
 
-from collections import namedtuple
-
-Release = namedtuple("Release", "name distribution label components")
-Component = namedtuple("Component", "name label desc groups")
-
 class Installer:
     def __init__(self, api, installer, config_dir, stack, login_page, repositories_page, components_page,
-            products_page, summary_page, progress_page):
+            products_page, summary_page, progress_page, snapshot_path=None, offline=False):
         self.api = api
         self.installer = installer
         self.stack = stack
         self.config_dir = config_dir
         self.authorized = False
+        self.snapshot_path = snapshot_path
+        self.snapshot = CatalogSnapshot.load(snapshot_path) if snapshot_path else None
+        self._snapshot_refresh = None
+        self._snapshot_deadline = None
+        # Not api.executor: the refresh blocks on api.map, which fans out to that pool.
+        self.snapshot_executor = ThreadPoolExecutor(max_workers=1)
+        self.prefetcher = Prefetcher(deadline=lambda: self.api.deadline(STEP_TIMEOUT))
+        self.tasks = TaskRunner()
+        self._busy_page = None
+        self._catalog_model = None
+        self.revalidation = TaskRunner(max_workers=1)
+        self.releases_id = {}
+        self.online_api = api
+        self.offline = False
         
         self.login_page = login_page
         stack.add(login_page)
@@ -33,11 +46,14 @@ class Installer:
         stack.add(repositories_page)
         repositories_page.back_button.connect("clicked", self.on_repositories_back_clicked)
         repositories_page.ok_button.connect("clicked", self.on_repositories_next_clicked)
+        repositories_page.connect("selection-changed", self.on_repositories_selection_changed)
+        repositories_page.refresh_button.connect("clicked", self.on_refresh_clicked)
         
         self.components_page = components_page
         stack.add(components_page)
         components_page.back_button.connect("clicked", self.on_components_back_clicked)
         components_page.ok_button.connect("clicked", self.on_components_next_clicked)
+        components_page.connect("selection-changed", self.on_components_selection_changed)
        
         self.products_page = products_page
         stack.add(products_page)
@@ -65,56 +81,136 @@ class Installer:
         
         api.username = self.config.get("username")
         api.token = self.config.get("token")
+        if offline:
+            self.offline = self.go_offline()
         if api.username and api.token:
-            try:
-                self.switch_to_repositories()
-            except HTTPError:
-                self.switch_to_login()
+            if self.catalog is self.snapshot:
+                # Stale-while-revalidate: the saved repository list is shown right away, the token and the list
+                # are checked in the background.
+                self.show_repositories(self.load_repositories())
+                if not self.offline:
+                    self.revalidate()
+            else:
+                self.switch_to_repositories(self.login_page, lambda e: self.switch_to_login())
+    
+    def go_offline(self):
+        snapshot = self.snapshot
+        if snapshot is None or not snapshot.matches(self.api):
+            print("No cached catalog is available for offline mode, continuing online.")
+            return False
+        self.api = OfflineApi(snapshot, self.api.username, self.api.token)
+        return True
+    
+    def revalidate(self):
+        api = self.api
+        
+        def work(task):
+            with api.deadline(STEP_TIMEOUT) as deadline:
+                task.deadline = deadline
+                # The token is checked with me/, the list is confirmed by the server even if cached.
+                me, repositories = api.map(lambda load: load(), (lambda: api.me,
+                    lambda: api.make_request("repository/repositories/", revalidate=True)))
+            return [repo for repo in repositories if repo["active"]]
+        
+        self.revalidation.run(work, self.on_revalidated, self.on_revalidation_failed)
+    
+    def on_revalidated(self, repositories):
+        page = self.repositories_page
+        if repositories != page.repositories and self.stack.get_visible_child() is page and self._busy_page is None:
+            page.set_repositories(repositories, page.repo["id"] if page.repo else None)
+    
+    def on_revalidation_failed(self, error):
+        if isinstance(error, ServerError) and error.status in (401, 403):
+            username = self.api.username
+            self.cancel_step()
+            self.api.logout()
+            self.config.pop("token", None)
+            self.save_config()
+            self.authorized = False
+            page = self.login_page
+            page.option_account.set_active(True)
+            page.username_entry.set_text(username or "")
+            page.set_error("Your session has expired. Sign in again, please.")
+            self.switch_to_login()
+        else:
+            self.repositories_page.set_status("Showing saved data, the server could not be reached.")
     
     def save_config(self):
-        with open(os.path.join(self, self.config_dir, CONFIG_FILENAME), "wt") as f:
+        with open(os.path.join(self.config_dir, CONFIG_FILENAME), "wt") as f:
             json.dump(self.config, f)
     
     def on_quit_clicked(self, *args):
         Gtk.main_quit()
     
+    def shutdown(self):
+        # Cancels background work, so that the process does not outlive the window waiting for a stalled server.
+        self.tasks.shutdown()
+        self.revalidation.shutdown()
+        self.prefetcher.shutdown()
+        deadline = self._snapshot_deadline
+        if deadline is not None:
+            deadline.cancel()
+        self.snapshot_executor.shutdown(wait=False, cancel_futures=True)
+        self.online_api.shutdown()
+    
     def on_sign_in_clicked(self, *args):
         page = self.login_page
         if not page.option_account.get_active():
             self.authorized = False
-            self.switch_to_repositories()
+            self.switch_to_repositories(page)
         else:
             username = page.username_entry.get_text().strip()
             password = page.password_entry.get_text()
-            
-            try:
-                page.set_error("Signing in ...")
-                page.set_widgets_sensitive(False)
-                self.api.login(username, password)
-                page.set_widgets_sensitive(True)
-                page.set_error()
-                self.config["username"] = self.api.username
-                self.config["token"] = self.api.token
-                self.save_config()
-                self.authorized = True
-                self.switch_to_repositories()
-            except ApiError as e:
-                page.set_error(str(e))
-                page.set_widgets_sensitive(True)
+            page.set_error("Signing in ...")
+            self.run_step(page, lambda: self.api.login(username, password), self.on_signed_in,
+                lambda e: page.set_error(str(e)))
+    
+    def on_signed_in(self, result):
+        self.login_page.set_error()
+        self.config["username"] = self.api.username
+        self.config["token"] = self.api.token
+        self.save_config()
+        self.authorized = True
+        self.switch_to_repositories(self.login_page)
     
     def on_repositories_back_clicked(self, *args):
+        self.cancel_step()
         self.switch_to_login()
     
+    def on_refresh_clicked(self, *args):
+        page = self.repositories_page
+        
+        def failed(e):
+            page.set_status("{} Refresh failed: {}".format(self.api.describe(), e), refresh=True)
+        
+        self.run_step(page, self.refresh_catalog, lambda result: self.switch_to_repositories(page), failed)
+    
+    def refresh_catalog(self):
+        api = self.online_api
+        api.username = self.api.username
+        api.token = self.api.token
+        api.invalidate()
+        self.snapshot.refresh(api)
+        self.snapshot.save(self.snapshot_path)
+    
+    def on_repositories_selection_changed(self, *args):
+        self.prefetch_components()
+    
     def on_repositories_next_clicked(self, *args):
         self.switch_to_components()
     
     def on_components_back_clicked(self, *args):
+        self.cancel_step()
         self.stack.set_visible_child(self.repositories_page)
     
+    def on_components_selection_changed(self, *args):
+        self.prefetch_products()
+    
     def on_components_next_clicked(self, *args):
         self.switch_to_products()
     
     def on_products_back_clicked(self, *args):
+        self.cancel_step()
         self.stack.set_visible_child(self.components_page)
     
     def on_products_next_clicked(self, *args):
@@ -135,58 +231,183 @@ class Installer:
     def switch_to_login(self):
         self.stack.set_visible_child(self.login_page)
     
-    def switch_to_repositories(self):
-        self.repositories_page.set_repositories([repo for repo in self.api.repositories if repo["active"]])
-        self.stack.set_visible_child(self.repositories_page)
-    
-    def switch_to_components(self):
-        components = (self.api.component(pk) for pk in self.repositories_page.repo.get("component_set", ()))
-        self.components_id = {}
-        groups = {i["id"]: i for i in self.api.groups}
-        releases = {
-            i["id"]:
-            Release(i["name"], self.api.distribution(i["distribution"])["name"], "{} {}".format(self.api.distribution(i["distribution"])["label"], i["label"]), {})
-            for i in self.api.repo_releases
-        }
+    def run_step(self, page, load, show, failed=None):
+        # Loads data for the next step on a worker thread, so that the main loop keeps running while the page
+        # shows it is busy. The deadline of the online API applies to the snapshot refresh of offline mode too.
+        api = self.online_api
         
-        self.releases_id = {r.name: r_id for (r_id, r) in releases.items()}
-        self.releases_dists = {r.name: r.distribution for  r in releases.values()}
+        def work(task):
+            with api.deadline(STEP_TIMEOUT) as deadline:
+                task.deadline = deadline
+                return load()
         
-        for c in components:
-            if c["active"]:
-                self.components_id[c["name"]] = c["id"]
-                for access in c["access_set"]:
-                    access_groups = {g: groups[g]["name"] for g in access["groups"]}
-                    component = Component(c["name"], c["label"], c["desc"], access_groups)
-                    releases[access["release"]].components[c["name"]] = component
+        def done(result):
+            self._set_busy_page(None)
+            show(result)
         
-        options = {r.name: r for r in releases.values() if r.components}
+        def error(e):
+            self._set_busy_page(None)
+            if failed is not None:
+                failed(e)
+            else:
+                self.show_error(page, e)
         
-        del groups, components, releases
+        self._set_busy_page(page)
+        self.tasks.run(work, done, error)
+    
+    def cancel_step(self):
+        self.tasks.cancel()
+        self._set_busy_page(None)
+    
+    def _set_busy_page(self, page):
+        if self._busy_page is not None:
+            self._busy_page.set_busy(False)
+        self._busy_page = page
+        if page is not None:
+            page.set_busy(True)
+    
+    def show_error(self, page, error):
+        message = str(error) if isinstance(error, (ApiError, OSError)) else "Unexpected error: {}".format(error)
+        dialog = Gtk.MessageDialog(transient_for=page.get_toplevel(), modal=True, message_type=Gtk.MessageType.ERROR,
+            buttons=Gtk.ButtonsType.CLOSE, text=message)
+        dialog.connect("response", lambda dialog, response: dialog.destroy())
+        dialog.show()
+    
+    @property
+    def catalog(self):
+        snapshot = self.snapshot
+        return snapshot if snapshot is not None and snapshot.matches(self.api) else self.api
+    
+    def refresh_snapshot(self):
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.matches(self.api) and not snapshot.is_due():
+            return
+        if self.snapshot_path and not self.offline and (self._snapshot_refresh is None or self._snapshot_refresh.done()):
+            self._snapshot_refresh = self.snapshot_executor.submit(self._refresh_snapshot)
+    
+    def _refresh_snapshot(self):
+        snapshot = self.snapshot
+        if snapshot is None or not snapshot.matches(self.api):
+            snapshot = CatalogSnapshot(self.api.root, self.api.username if self.api.token else None)
+        try:
+            # No time limit, the deadline only lets shutdown() stop the refresh.
+            with self.api.deadline(None) as deadline:
+                self._snapshot_deadline = deadline
+                # Sequential requests on this thread do not compete with the step the user is waiting for.
+                snapshot.refresh(self.api, package_indexes=False, map=map)
+            snapshot.save(self.snapshot_path)
+        except (ApiError, OSError) as e:
+            print("Failed to refresh catalog snapshot: {}".format(e))
+            return
+        finally:
+            self._snapshot_deadline = None
+        self.snapshot = snapshot
+    
+    def remember_package_index(self, index):
+        # Package indexes of visited releases are kept in the snapshot for offline mode.
+        snapshot = self.snapshot
+        if self.offline or not self.snapshot_path or snapshot is None or not snapshot.matches(self.api):
+            return
+        if snapshot.package_indexes.get((index.repository, index.release)) != index:
+            snapshot.add_package_index(index)
+            self.snapshot_executor.submit(self._save_snapshot, snapshot)
+    
+    def _save_snapshot(self, snapshot):
+        try:
+            snapshot.save(self.snapshot_path)
+        except OSError as e:
+            print("Failed to save catalog snapshot: {}".format(e))
+    
+    def prefetch_components(self):
+        # Warms up the API memo so that switch_to_components finds its data ready or at least in flight.
+        repo = self.repositories_page.repo
+        if repo is None:
+            self.prefetcher.cancel()
+            return
         
-        self.components_page.set_data(self.api.me["groups"], options)
+        api = self.api
+        tasks = [lambda: api.me]
+        if self.catalog is api:
+            pks = repo.get("component_set", ())
+            tasks.extend((lambda: api.components(pks), lambda: api.groups, lambda: api.repo_releases,
+                lambda: api.distributions))
+        self.prefetcher.schedule(*tasks)
+    
+    def prefetch_products(self):
+        repo = self.repositories_page.repo
+        release_id = self.releases_id.get(self.components_page.dist)
+        if repo is None or release_id is None:
+            self.prefetcher.cancel()
+            return
+        
+        api = self.api
+        repo_id = repo["id"]
+        tasks = [lambda: api.package_index(repo_id, release_id)]
+        if self.catalog is api:
+            tasks.append(lambda: api.list_products(repository=repo_id))
+        self.prefetcher.schedule(*tasks)
+    
+    def switch_to_repositories(self, page, failed=None):
+        self.run_step(page, self.load_repositories, self.show_repositories, failed)
+    
+    def load_repositories(self):
+        return [repo for repo in self.catalog.repositories if repo["active"]]
+    
+    def show_repositories(self, repositories):
+        self.repositories_page.set_repositories(repositories)
+        if self.offline:
+            self.repositories_page.set_status(self.api.describe(), refresh=True)
+        self.stack.set_visible_child(self.repositories_page)
+        self.refresh_snapshot()
+        self.prefetch_components()
+    
+    def switch_to_components(self):
+        repo = self.repositories_page.repo
+        self.run_step(self.repositories_page, lambda: self.load_components(repo), self.show_components)
+    
+    def load_components(self, repo):
+        catalog = self.catalog
+        pks = repo.get("component_set", ())
+        try:
+            components = [catalog.component(pk) for pk in pks] if catalog is not self.api else None
+        except KeyError:
+            components = None  # The snapshot is older than the repository list.
+        if components is None:
+            components = self.api.components(pks)
+        model = self.get_catalog_model(catalog)
+        index = model.repository(repo["id"], components)
+        return model, index, index.access(self.api.me["groups"])
+    
+    def get_catalog_model(self, catalog):
+        groups, distributions, releases = catalog.groups, catalog.distributions, catalog.repo_releases
+        model = self._catalog_model
+        if model is None or not model.is_current(groups, distributions, releases):
+            model = self._catalog_model = CatalogModel(groups, distributions, releases)
+        return model
+    
+    def show_components(self, data):
+        model, index, access = data
+        self.releases_id = model.releases_id
+        self.releases_dists = model.releases_dists
+        self.components_id = index.components_id
+        self.components_page.set_data(access, index.options)
         self.stack.set_visible_child(self.components_page)
+        self.prefetch_products()
     
     def switch_to_products(self):
-        available_products = []
         repo_id = self.repositories_page.repo["id"]
         release_id = self.releases_id[self.components_page.dist]
-        
-        for product in self.api.list_products(repository=repo_id):
-            for pkg_name in product["packages"].split(","):
-                for component in self.components_page.enabled_components:
-                    component_id = self.components_id[component]
-                    packages = self.api.list_packages(repository=repo_id, component=component_id, release=release_id, name=pkg_name)
-                    if packages:
-                        # Success: Package found, no need to examine other components
-                        break
-                else:
-                    # Failure: Package not found in any component, no need to examine other packages
-                    break
-            else:
-                # Success: All packages checks were successful
-                available_products.append(product)
-        
+        components_id = [self.components_id[c] for c in self.components_page.enabled_components]
+        self.run_step(self.components_page, lambda: self.load_products(repo_id, release_id, components_id),
+            self.show_products)
+    
+    def load_products(self, repo_id, release_id, components_id):
+        # A single bulk request for all packages of the release instead of one request per package name.
+        index = self.api.package_index(repo_id, release_id)
+        self.remember_package_index(index)
+        return [p for p in self.catalog.list_products(repository=repo_id) if index.is_available(p, components_id)]
+    
+    def show_products(self, available_products):
         self.products = {p["id"]: p for p in available_products}
         self.products_page.set_data(available_products)
         if available_products:
@@ -202,8 +423,9 @@ class Installer:
     def switch_to_progress(self):
         self.progress_page.clear()
         self.stack.set_visible_child(self.progress_page)
-        self._queue = Queue()
-        GLib.idle_add(self._process_queue)
+        # The main loop wakes up only when the installer process has written something or exited.
+        self._queue = WakeupQueue()
+        GLib.io_add_watch(self._queue.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_IN, self._process_queue)
         self.progress_page.set_sensitive(False)
         
         release = self.components_page.dist
@@ -244,31 +466,34 @@ class Installer:
     def on_progress_done(self, worker, status):
         self._queue.put((False, status))
     
-    def _process_queue(self):
+    def _process_queue(self, fd, condition):
         running = True
-        try:
-            while True:
-                running, data = self._queue.get_nowait()
-                if hasattr(data, "encode"):
-                    data = data.encode("utf-8", errors='backslashreplace').decode("utf-8")
+        for running, data in self._queue.get_all():
+            if hasattr(data, "encode"):
+                data = data.encode("utf-8", errors='backslashreplace').decode("utf-8")
+            
+            if running:
+                sys.stdout.write(data)
+                sys.stdout.flush()
+                self.progress_page.write(data)
+            else:
+                self.progress_page.write("+ [Return code = {}]".format(data))
+                self.progress_page.set_sensitive(True)
                 
-                if running:
-                    sys.stdout.write(data)
-                    sys.stdout.flush()
-                    self.progress_page.write(data)
+                if data == 0:
+                    self.progress_page.set_message("<b>Installation has been successfully finished. You can close this window.</b>")
+                elif data == 127:
+                    self.progress_page.set_message("<b>Installation has failed because of authorization error.</b>")
+                elif data == 126:
+                    self.progress_page.set_message("<b>Installation has failed because of cancelled authorization.</b>")
                 else:
-                    self.progress_page.write("+ [Return code = {}]".format(data))
-                    self.progress_page.set_sensitive(True)
-                    
-                    if data == 0:
-                        self.progress_page.set_message("<b>Installation has been successfully finished. You can close this window.</b>")
-                    elif data == 127:
-                        self.progress_page.set_message("<b>Installation has failed because of authorization error.</b>")
-                    elif data == 126:
-                        self.progress_page.set_message("<b>Installation has failed because of cancelled authorization.</b>")
+                    if self.progress_page.log is not None:
+                        log = "the full log from {}.".format(GLib.markup_escape_text(self.progress_page.log_path))
                     else:
-                        self.progress_page.set_message("<b>Installation has failed. <a href=\"https://github.com/tiliado/tiliado-repositories/issues/new\">File a bug report</a> with the log bellow:</b>")
-        except Empty:
-            pass
+                        log = "the log bellow:"
+                    self.progress_page.set_message("<b>Installation has failed. <a href=\"https://github.com/tiliado/tiliado-repositories/issues/new\">File a bug report</a> with {}</b>".format(log))
         
+        if not running:
+            self._queue.close()
+            self.progress_page.flush()
         return running
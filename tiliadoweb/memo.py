@@ -0,0 +1,71 @@
+import threading
+from concurrent.futures import Future
+
+class Memo:
+    def __init__(self):
+        self._values = {}
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared = 0
+        self.misses = 0
+    
+    def get(self, key, func):
+        while True:
+            with self._lock:
+                try:
+                    value = self._values[key]
+                    self.hits += 1
+                    return value
+                except KeyError:
+                    pass
+                
+                call = self._calls.get(key)
+                if call is not None:
+                    # Single flight: wait for the call which is already in progress instead of issuing another one.
+                    self.shared += 1
+                    owner = False
+                else:
+                    self.misses += 1
+                    call = self._calls[key] = Future()
+                    owner = True
+            
+            if owner:
+                break
+            try:
+                return call.result()
+            except Exception as e:
+                # A failure which concerns only the caller that made the call, e.g. its cancelled deadline, is
+                # not shared, this caller tries again on its own.
+                if not getattr(e, "caller_specific", False):
+                    raise
+        
+        try:
+            value = func()
+        except BaseException as e:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.set_exception(e)
+            raise
+        
+        with self._lock:
+            # The call is no longer registered if the memo has been invalidated in the meantime.
+            if self._calls.get(key) is call:
+                del self._calls[key]
+                self._values[key] = value
+        call.set_result(value)
+        return value
+    
+    def peek(self, key, default=None):
+        with self._lock:
+            return self._values.get(key, default)
+    
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._values.clear()
+                self._calls.clear()
+            else:
+                self._values.pop(key, None)
+                self._calls.pop(key, None)
@@ -0,0 +1,114 @@
+import os
+import re
+import sys
+import json
+import atexit
+import threading
+from urllib.parse import urlsplit
+
+METRICS_ENV = "TILIADO_REPOSITORIES_METRICS"
+
+# Upper bounds of latency histogram buckets in seconds, the last bucket is unbounded.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+def endpoint_name(url):
+    return _ID_SEGMENT.sub("/{id}", urlsplit(url).path)
+
+class EndpointStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.cache = {"hit": 0, "miss": 0, "revalidated": 0}
+    
+    def add(self, latency, bytes_in, bytes_out, error):
+        self.count += 1
+        self.errors += bool(error)
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        self.latency_sum += latency
+        self.latency_max = max(self.latency_max, latency)
+        for index, bound in enumerate(BUCKETS):
+            if latency <= bound:
+                break
+        else:
+            index = len(BUCKETS)
+        self.buckets[index] += 1
+    
+    def percentile(self, percent):
+        # Linear interpolation within the histogram bucket holding the requested rank.
+        if not self.count:
+            return None
+        rank = self.count * percent / 100
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            if count and seen + count >= rank:
+                lower = BUCKETS[index - 1] if index else 0.0
+                upper = BUCKETS[index] if index < len(BUCKETS) else self.latency_max
+                return min(self.latency_max, lower + (upper - lower) * (rank - seen) / count)
+            seen += count
+        return self.latency_max
+    
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "latency_mean": self.latency_sum / self.count if self.count else None,
+            "latency_max": self.latency_max,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "histogram": dict(zip([str(b) for b in BUCKETS] + ["+Inf"], self.buckets)),
+            "cache": dict(self.cache),
+        }
+
+class ApiMetrics:
+    def __init__(self):
+        self._endpoints = {}
+        self._lock = threading.Lock()
+    
+    def _get(self, endpoint):
+        stats = self._endpoints.get(endpoint)
+        if stats is None:
+            stats = self._endpoints[endpoint] = EndpointStats()
+        return stats
+    
+    def record(self, endpoint, latency, bytes_in=0, bytes_out=0, error=False):
+        with self._lock:
+            self._get(endpoint).add(latency, bytes_in, bytes_out, error)
+    
+    def record_cache(self, endpoint, result):
+        with self._lock:
+            self._get(endpoint).cache[result] += 1
+    
+    def snapshot(self):
+        with self._lock:
+            return {endpoint: stats.snapshot() for (endpoint, stats) in sorted(self._endpoints.items())}
+    
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+    
+    def dump(self, filename):
+        data = json.dumps(self.snapshot(), indent=2)
+        if filename == "-":
+            print(data)
+            return
+        try:
+            with open(filename, "w", encoding="utf-8") as f:
+                f.write(data)
+        except OSError as e:
+            print("Failed to write API metrics to {}: {}".format(filename, e), file=sys.stderr)
+    
+    def dump_on_exit(self, filename=None):
+        filename = filename or os.environ.get(METRICS_ENV)
+        if filename:
+            atexit.register(self.dump, filename)
@@ -0,0 +1,97 @@
+import time
+from contextlib import contextmanager
+from tiliadoweb.api import ApiError
+
+STALE_AFTER = 7 * 24 * 3600
+
+def describe_age(created, now=None):
+    age = max(0, (now or time.time()) - created)
+    for unit, seconds in (("day", 24 * 3600), ("hour", 3600), ("minute", 60)):
+        if age >= seconds:
+            count = int(age // seconds)
+            return "{} {}{} ago".format(count, unit, "s" if count > 1 else "")
+    return "just now"
+
+class OfflineApi:
+    # Stands in for TiliadoApi and serves the wizard from a catalog snapshot without any network access.
+    def __init__(self, snapshot, username=None, token=None):
+        self.snapshot = snapshot
+        self.root = snapshot.root
+        self.username = username
+        self.token = token
+    
+    @property
+    def created(self):
+        return self.snapshot.created
+    
+    def is_stale(self, now=None):
+        return (now or time.time()) - self.snapshot.created > STALE_AFTER
+    
+    def describe(self):
+        text = "Offline mode: catalog updated {}.".format(describe_age(self.snapshot.created))
+        if self.is_stale():
+            text += " It may be out of date."
+        return text
+    
+    def login(self, username, password, scope="default"):
+        raise ApiError("Signing in is not possible in offline mode.")
+    
+    def logout(self):
+        self.username = None
+        self.token = None
+    
+    def invalidate(self):
+        pass
+    
+    def map(self, func, items):
+        return [func(item) for item in items]
+    
+    @contextmanager
+    def deadline(self, timeout):
+        yield
+    
+    @property
+    def me(self):
+        if self.snapshot.me is None:
+            raise ApiError("The cached catalog does not contain user information.")
+        return self.snapshot.me
+    
+    @property
+    def repositories(self):
+        return self.snapshot.repositories
+    
+    @property
+    def repo_releases(self):
+        return self.snapshot.repo_releases
+    
+    @property
+    def distributions(self):
+        return self.snapshot.distributions
+    
+    def distribution(self, key):
+        try:
+            return self.snapshot.distribution(key)
+        except KeyError:
+            raise ApiError("Distribution {} is not in the cached catalog.".format(key))
+    
+    @property
+    def groups(self):
+        return self.snapshot.groups
+    
+    def component(self, identifier):
+        try:
+            return self.snapshot.component(identifier)
+        except KeyError:
+            raise ApiError("Component {} is not in the cached catalog.".format(identifier))
+    
+    def components(self, identifiers):
+        return [self.component(i) for i in identifiers]
+    
+    def list_products(self, **params):
+        return self.snapshot.list_products(params.get("repository"))
+    
+    def package_index(self, repository, release):
+        try:
+            return self.snapshot.package_index(repository, release)
+        except KeyError:
+            raise ApiError("Package availability for this release is not cached. Refresh the catalog first.")
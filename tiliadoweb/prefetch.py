@@ -0,0 +1,63 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class Prefetcher:
+    # Runs speculative requests for the next wizard step on a small pool of its own, so that it never delays
+    # requests the user is actually waiting for. Scheduling new work makes the previous batch stale. Tasks run
+    # within the context manager returned by deadline(), if given, which may yield a Deadline to expire on shutdown.
+    def __init__(self, max_workers=2, deadline=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.deadline = deadline
+        self._generation = 0
+        self._futures = []
+        self._deadlines = set()
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.skipped = 0
+    
+    def schedule(self, *tasks):
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+            for future in self._futures:
+                future.cancel()
+            self._futures = [self.executor.submit(self._run, generation, task) for task in tasks]
+    
+    def cancel(self):
+        self.schedule()
+    
+    def shutdown(self):
+        self.cancel()
+        with self._lock:
+            deadlines = list(self._deadlines)
+        for deadline in deadlines:
+            deadline.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+    
+    def is_stale(self, generation):
+        return generation != self._generation
+    
+    def _run(self, generation, task):
+        if self.is_stale(generation):
+            self.skipped += 1
+            return
+        try:
+            if self.deadline is None:
+                task()
+            else:
+                with self.deadline() as deadline:
+                    self._run_with_deadline(deadline, task)
+            self.completed += 1
+        except Exception as e:
+            print("Prefetch failed: {}".format(e))
+    
+    def _run_with_deadline(self, deadline, task):
+        if deadline is None:
+            return task()
+        with self._lock:
+            self._deadlines.add(deadline)
+        try:
+            return task()
+        finally:
+            with self._lock:
+                self._deadlines.discard(deadline)
@@ -0,0 +1,272 @@
+import os
+import json
+import time
+import atexit
+import threading
+from base64 import b64encode, b64decode
+from collections import deque
+from http.client import HTTPMessage
+from urllib.parse import urlsplit
+
+RECORD_ENV = "TILIADO_REPOSITORIES_RECORD"
+REPLAY_ENV = "TILIADO_REPOSITORIES_REPLAY"
+FORMAT_VERSION = 1
+
+# Headers which must not end up in a fixture file or which no longer apply to the decoded body.
+SKIPPED_REQUEST_HEADERS = frozenset(("authorization", "proxy-authorization"))
+SKIPPED_RESPONSE_HEADERS = frozenset(("content-encoding", "content-length", "transfer-encoding", "set-cookie"))
+REDACTED_FIELDS = ("token",)
+
+def request_key(method, url):
+    # The server part is left out, so that a session can be replayed with any server address.
+    parts = urlsplit(url)
+    return method, "{}?{}".format(parts.path, parts.query) if parts.query else parts.path
+
+def encode_body(body):
+    try:
+        return {"body": body.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"body_base64": b64encode(body).decode("ascii")}
+
+def decode_body(entry):
+    if "body_base64" in entry:
+        return b64decode(entry["body_base64"])
+    return entry.get("body", "").encode("utf-8")
+
+def redact(body):
+    try:
+        data = json.loads(body.decode("utf-8"))
+    except ValueError:
+        return body
+    if not isinstance(data, dict) or not any(field in data for field in REDACTED_FIELDS):
+        return body
+    for field in REDACTED_FIELDS:
+        if field in data:
+            data[field] = "redacted"
+    return json.dumps(data).encode("utf-8")
+
+class RecordedResponse:
+    # Stands in for PooledResponse with a body that has already been received and decoded.
+    def __init__(self, pool, status, reason, headers, body, received, elapsed, on_close=None):
+        self.pool = pool
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.data = None
+        self.received = 0
+        self.decoded = 0
+        self._body = body
+        self._received = received
+        self._elapsed = elapsed
+        self._on_close = on_close
+        self._closed = False
+    
+    def read(self):
+        if self.data is None:
+            self.data = self._body
+            self.received = self._received
+            self.decoded = len(self._body)
+            self.close()
+        return self.data
+    
+    def iter_chunks(self, size=64 * 1024):
+        try:
+            for offset in range(0, len(self._body), size):
+                yield self._body[offset:offset + size]
+            self.received = self._received
+            self.decoded = len(self._body)
+        finally:
+            self.close()
+    
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.pool._record(self.received, self.decoded, self._elapsed)
+        if self._on_close is not None:
+            self._on_close(self, self._elapsed)
+
+class RecordingPool:
+    # Passes requests to another pool and records them together with their timing.
+    def __init__(self, pool, filename=None):
+        self.pool = pool
+        self.filename = filename
+        self.entries = []
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def stats(self):
+        return self.pool.stats()
+    
+    def close(self):
+        self.pool.close()
+    
+    def _record(self, received, decoded, elapsed):
+        pass  # The wrapped pool has already counted the transfer.
+    
+    def request(self, method, url, body=None, headers=None, timeout=None, on_close=None):
+        response = self.open(method, url, body, headers, timeout, on_close)
+        response.read()
+        return response
+    
+    def open(self, method, url, body=None, headers=None, timeout=None, on_close=None):
+        started = time.monotonic()
+        response = self.pool.open(method, url, body, headers, timeout)
+        data = response.read()
+        elapsed = time.monotonic() - started
+        
+        entry = {
+            "method": method,
+            "url": url,
+            "request_headers": {k: v for (k, v) in (headers or {}).items() if k.lower() not in SKIPPED_REQUEST_HEADERS},
+            "request_size": len(body or b""),
+            "started": started - self._started,
+            "elapsed": elapsed,
+            "status": response.status,
+            "reason": response.reason,
+            "headers": [(k, v) for (k, v) in response.headers.items() if k.lower() not in SKIPPED_RESPONSE_HEADERS],
+            "received": response.received,
+        }
+        entry.update(encode_body(redact(data)))
+        with self._lock:
+            self.entries.append(entry)
+        return RecordedResponse(self, response.status, response.reason, response.headers, data, response.received,
+            elapsed, on_close)
+    
+    def save(self, filename=None):
+        filename = filename or self.filename
+        with self._lock:
+            entries = list(self.entries)
+        with open(filename + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"version": FORMAT_VERSION, "entries": entries}, f, indent=1)
+        os.replace(filename + ".tmp", filename)
+
+class ReplayPool:
+    # Serves recorded responses in the order they were recorded for each method and path. With emulate_latency,
+    # every response is delayed by its recorded duration divided by speed.
+    def __init__(self, entries, emulate_latency=False, speed=1.0):
+        self.emulate_latency = emulate_latency
+        self.speed = speed
+        self.recorded = len(entries)
+        self._queues = {}
+        for entry in entries:
+            self._queues.setdefault(request_key(entry["method"], entry["url"]), deque()).append(entry)
+        self._last = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.repeated = 0
+        self.missing = 0
+        self.bytes_received = 0
+        self.bytes_decoded = 0
+        self.time = 0.0
+    
+    @classmethod
+    def load(cls, filename, emulate_latency=False, speed=1.0):
+        with open(filename, "r", encoding="utf-8") as f:
+            fixture = json.load(f)
+        if fixture.get("version") != FORMAT_VERSION:
+            raise ValueError("Unsupported fixture version {}.".format(fixture.get("version")))
+        return cls(fixture["entries"], emulate_latency, speed)
+    
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "connections": 0,
+                "reused": 0,
+                "reconnects": 0,
+                "bytes_received": self.bytes_received,
+                "bytes_decoded": self.bytes_decoded,
+                "time": self.time,
+                "idle": 0,
+                "recorded": self.recorded,
+                "repeated": self.repeated,
+                "missing": self.missing,
+            }
+    
+    def close(self):
+        pass
+    
+    def _record(self, received, decoded, elapsed):
+        with self._lock:
+            self.bytes_received += received
+            self.bytes_decoded += decoded
+            self.time += elapsed
+    
+    def request(self, method, url, body=None, headers=None, timeout=None, on_close=None):
+        response = self.open(method, url, body, headers, timeout, on_close)
+        response.read()
+        return response
+    
+    def open(self, method, url, body=None, headers=None, timeout=None, on_close=None):
+        key = request_key(method, url)
+        with self._lock:
+            self.requests += 1
+            queue = self._queues.get(key)
+            if queue:
+                entry = self._last[key] = queue.popleft()
+            else:
+                # New client code may repeat a request the recorded session made only once.
+                entry = self._last.get(key)
+                if entry is None:
+                    self.missing += 1
+                else:
+                    self.repeated += 1
+        if entry is None:
+            raise ConnectionRefusedError("No recorded response for {} {}.".format(method, url))
+        
+        elapsed = entry["elapsed"] / self.speed if self.emulate_latency else 0.0
+        if elapsed:
+            time.sleep(elapsed)
+        headers = HTTPMessage()
+        for name, value in entry["headers"]:
+            headers[name] = value
+        return RecordedResponse(self, entry["status"], entry["reason"], headers, decode_body(entry), entry["received"],
+            elapsed, on_close)
+
+def wrap_pool(pool):
+    # Records the session to the file named by TILIADO_REPOSITORIES_RECORD or replays the one named by
+    # TILIADO_REPOSITORIES_REPLAY instead of contacting the server.
+    replay = os.environ.get(REPLAY_ENV)
+    if replay:
+        return ReplayPool.load(replay, emulate_latency=True)
+    record = os.environ.get(RECORD_ENV)
+    if record:
+        pool = RecordingPool(pool, record)
+        atexit.register(pool.save)
+    return pool
+
+def main():
+    import argparse
+    from tiliadoweb.api import TiliadoApi
+    from tiliadoweb.benchmark import measure
+    from tiliadoweb.connection import ConnectionPool
+    parser = argparse.ArgumentParser(description="Record or replay the installer data flow.")
+    parser.add_argument("fixture", type=str)
+    parser.add_argument("--record", type=str, default=None, metavar="SERVER", help="Record a session with SERVER.")
+    parser.add_argument("--latency", action="store_true", default=False, help="Emulate recorded latency.")
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--anonymous", action="store_true", default=False)
+    args = parser.parse_args()
+    
+    if args.record:
+        server = args.record
+        pool = RecordingPool(ConnectionPool(), args.fixture)
+    else:
+        server = "http://replay.invalid/"
+        pool = ReplayPool.load(args.fixture, args.latency, args.speed)
+    
+    result = measure("record" if args.record else "replay",
+        lambda: TiliadoApi(server, "api/", "api-auth/obtain-token/", pool=pool), not args.anonymous)
+    elapsed = "failed: {}".format(result["error"]) if result["wall_time"] is None else "{:.1f} ms".format(
+        result["wall_time"] * 1000)
+    if args.record:
+        pool.save()
+        print("Recorded {} requests, {}.".format(len(pool.entries), elapsed))
+    else:
+        stats = pool.stats()
+        print("Replayed {} requests, {}, recorded {}, repeated {}, missing {}.".format(
+            result["round_trips"], elapsed, stats["recorded"], stats["repeated"], stats["missing"]))
+
+if __name__ == "__main__":
+    main()
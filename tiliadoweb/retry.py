@@ -0,0 +1,66 @@
+import random
+import threading
+import time
+from collections import deque
+
+class Deadline:
+    def __init__(self, timeout):
+        self.expires = time.monotonic() + timeout if timeout is not None else None
+    
+    def remaining(self):
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.monotonic())
+    
+    def expired(self):
+        return self.expires is not None and time.monotonic() >= self.expires
+    
+    def cancel(self):
+        self.expires = time.monotonic()
+    
+    def timeout(self, timeout=None):
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        return remaining if timeout is None else min(timeout, remaining)
+
+class RetryBudget:
+    # Token bucket: every request earns a fraction of a retry, every retry spends a whole token. It caps retries
+    # to a fixed share of the traffic, so that a failing server is not flooded with retries.
+    def __init__(self, ratio=0.2, initial=3.0, max_tokens=10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = initial
+        self._lock = threading.Lock()
+    
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+    
+    def withdraw(self):
+        with self._lock:
+            if self.tokens < 1.0:
+                return False
+            self.tokens -= 1.0
+            return True
+
+def backoff(attempt, base=0.25, cap=4.0):
+    # Exponential backoff with full jitter.
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+class LatencyTracker:
+    def __init__(self, size=200, min_samples=20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+    
+    def add(self, latency):
+        with self._lock:
+            self._samples.append(latency)
+    
+    def percentile(self, percent):
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(len(samples) * percent / 100))]
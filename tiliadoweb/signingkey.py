@@ -0,0 +1,169 @@
+import os
+import re
+import hashlib
+import binascii
+import urllib.request
+
+KEYSERVER_URL = "http://keyserver.ubuntu.com/pks/lookup?search=0x{}&op=get"
+CACHE_DIR = "/var/cache/tiliado-repositories"
+ARMOR_BEGIN = "-----BEGIN PGP PUBLIC KEY BLOCK-----"
+ARMOR_END = "-----END PGP PUBLIC KEY BLOCK-----"
+PUBLIC_KEY_TAG = 6
+_FINGERPRINT = re.compile("^[0-9A-F]{40}$")
+
+class SigningKeyError(Exception):
+    pass
+
+def crc24(data):
+    crc = 0xB704CE
+    for byte in data:
+        crc ^= byte << 16
+        for i in range(8):
+            crc <<= 1
+            if crc & 0x1000000:
+                crc ^= 0x1864CFB
+    return crc & 0xFFFFFF
+
+def dearmor(text):
+    lines = [line.strip() for line in text.splitlines()]
+    try:
+        start = lines.index(ARMOR_BEGIN) + 1
+        end = lines.index(ARMOR_END, start)
+    except ValueError:
+        raise SigningKeyError("No ASCII armored public key block found.")
+    lines = lines[start:end]
+    # Armor headers end with an empty line.
+    if "" in lines:
+        lines = lines[lines.index("") + 1:]
+    checksum = None
+    if lines and lines[-1].startswith("="):
+        checksum = lines.pop()[1:]
+    try:
+        data = binascii.a2b_base64("".join(lines))
+        if checksum is not None and int.from_bytes(binascii.a2b_base64(checksum), "big") != crc24(data):
+            raise SigningKeyError("Armor checksum mismatch.")
+    except binascii.Error as e:
+        raise SigningKeyError("Malformed ASCII armor. {}".format(e))
+    return data
+
+def iter_packets(data):
+    offset = 0
+    size = len(data)
+    while offset < size:
+        header = data[offset]
+        if not header & 0x80:
+            raise SigningKeyError("Invalid packet header at offset {}.".format(offset))
+        if header & 0x40:
+            tag = header & 0x3F
+            first = data[offset + 1]
+            if first < 192:
+                length, offset = first, offset + 2
+            elif first < 224:
+                length, offset = ((first - 192) << 8) + data[offset + 2] + 192, offset + 3
+            elif first == 255:
+                length, offset = int.from_bytes(data[offset + 2:offset + 6], "big"), offset + 6
+            else:
+                raise SigningKeyError("Partial body lengths are not used by public keys.")
+        else:
+            tag = (header >> 2) & 0x0F
+            length_type = header & 0x03
+            if length_type == 3:
+                raise SigningKeyError("Indeterminate packet lengths are not supported.")
+            length_size = 1 << length_type
+            length = int.from_bytes(data[offset + 1:offset + 1 + length_size], "big")
+            offset += 1 + length_size
+        if offset + length > size:
+            raise SigningKeyError("Truncated packet at offset {}.".format(offset))
+        yield tag, data[offset:offset + length]
+        offset += length
+
+def fingerprint(body):
+    # RFC 4880, section 12.2: SHA-1 of 0x99, the two-octet length and the body of the public key packet.
+    if not body or body[0] != 4:
+        raise SigningKeyError("Unsupported public key version {}.".format(body[0] if body else None))
+    return hashlib.sha1(b"\x99" + len(body).to_bytes(2, "big") + body).hexdigest().upper()
+
+def normalize_fingerprint(fpr):
+    fpr = "".join((fpr or "").split()).upper()
+    if not _FINGERPRINT.match(fpr):
+        raise SigningKeyError("A full 40 digit key fingerprint is required, got {!r}.".format(fpr or None))
+    return fpr
+
+def verify(data, fpr):
+    # The keyring must contain exactly one primary key, the one with the pinned fingerprint.
+    fpr = normalize_fingerprint(fpr)
+    try:
+        keys = [fingerprint(body) for (tag, body) in iter_packets(data) if tag == PUBLIC_KEY_TAG]
+    except IndexError:
+        raise SigningKeyError("Truncated packet header.")
+    if len(keys) != 1:
+        raise SigningKeyError("Expected a single public key, found {}.".format(len(keys)))
+    if keys[0] != fpr:
+        raise SigningKeyError("Fingerprint {} does not match the expected {}.".format(keys[0], fpr))
+    return keys[0]
+
+class SigningKey:
+    # The public key is downloaded once and kept in the cache directory as ASCII armor, it is verified against
+    # the pinned fingerprint whenever it is read.
+    def __init__(self, fpr, cache_dir=CACHE_DIR, log=print, dry_run=False, url=KEYSERVER_URL, timeout=30):
+        self.fingerprint = normalize_fingerprint(fpr)
+        self.key = self.fingerprint[-16:]
+        self.dry_run = dry_run
+        self.cache_dir = cache_dir
+        self.log = log
+        self.url = url.format(self.fingerprint)
+        self.timeout = timeout
+        self.path = os.path.join(cache_dir, "{}.asc".format(self.key))
+    
+    def armored(self):
+        # Returns None in a dry run if the key is not cached yet, nothing is downloaded then.
+        try:
+            with open(self.path, "r", encoding="ascii") as f:
+                text = f.read()
+            verify(dearmor(text), self.fingerprint)
+            return text
+        except (OSError, ValueError, SigningKeyError) as e:
+            if os.path.exists(self.path):
+                self.log("Cached key '{}' is not valid. {}".format(self.path, e))
+        
+        self.log("+ [fetch key {}]".format(self.url))
+        if self.dry_run:
+            self.log("*** Dry run ***\n")
+            return None
+        with urllib.request.urlopen(self.url, timeout=self.timeout) as response:
+            text = response.read().decode("ascii", errors="replace")
+        verify(dearmor(text), self.fingerprint)
+        self.log("+ [key fingerprint {}]".format(self.fingerprint))
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(self.path + ".tmp", "w", encoding="ascii") as f:
+                f.write(text)
+            os.replace(self.path + ".tmp", self.path)
+        except OSError as e:
+            self.log("Failed to cache key '{}'. {}".format(self.path, e))
+        return text
+    
+    def is_installed(self, keyring):
+        try:
+            with open(keyring, "rb") as f:
+                verify(f.read(), self.fingerprint)
+            return True
+        except (OSError, SigningKeyError):
+            return False
+    
+    def install(self, keyring):
+        # APT reads binary keyrings from trusted.gpg.d, so the key is dearmored rather than kept as it is.
+        if self.is_installed(keyring):
+            self.log("+ [key {} already installed in '{}']".format(self.key, keyring))
+            return False
+        text = self.armored()
+        self.log("+ [write '{}']".format(keyring))
+        if self.dry_run:
+            self.log("*** Dry run ***\n")
+            return True
+        data = dearmor(text)
+        with open(keyring + ".tmp", "wb") as f:
+            f.write(data)
+        os.chmod(keyring + ".tmp", 0o644)
+        os.replace(keyring + ".tmp", keyring)
+        return True
@@ -0,0 +1,141 @@
+import os
+import json
+import mmap
+import time
+import zlib
+import threading
+from tiliadoweb.catalog import PackageIndex
+
+MAGIC = b"TLDSNAP"
+VERSION = 2
+HEADER_SIZE = len(MAGIC) + 1
+# The catalog is refreshed in the background at most this often (seconds), the Refresh button always refreshes.
+REFRESH_AFTER = 6 * 3600
+
+class CatalogSnapshot:
+    def __init__(self, root, username=None, created=None, repositories=None, components=None, repo_releases=None,
+            distributions=None, groups=None, products=None, me=None, package_indexes=None):
+        self.root = root
+        self.username = username
+        self.created = created
+        self.repositories = repositories or []
+        self.components = components or {}
+        self.repo_releases = repo_releases or []
+        self.distributions = distributions or []
+        self.groups = groups or []
+        self.products = products or {}
+        self.me = me
+        self.package_indexes = package_indexes or {}
+        self._distributions = None
+    
+    @classmethod
+    def load(cls, filename):
+        try:
+            with open(filename, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if data[:len(MAGIC)] != MAGIC:
+                    print("Catalog snapshot {} has invalid format.".format(filename))
+                    return None
+                if data[len(MAGIC)] != VERSION:
+                    print("Catalog snapshot {} has unsupported version {}.".format(filename, data[len(MAGIC)]))
+                    return None
+                catalog = json.loads(zlib.decompress(data[HEADER_SIZE:]).decode("utf-8"))
+        except (OSError, ValueError, zlib.error) as e:
+            print("Failed to load catalog snapshot {}: {}".format(filename, e))
+            return None
+        
+        return cls(catalog["root"], catalog["username"], catalog["created"], catalog["repositories"],
+            {c["id"]: c for c in catalog["components"]}, catalog["repo_releases"], catalog["distributions"],
+            catalog["groups"], {int(k): v for (k, v) in catalog["products"].items()}, catalog["me"],
+            {(i["repository"], i["release"]): PackageIndex(i["repository"], i["release"],
+            {name: set(components) for (name, components) in i["packages"].items()}) for i in catalog["package_indexes"]})
+    
+    def save(self, filename):
+        catalog = {
+            "root": self.root,
+            "username": self.username,
+            "created": self.created,
+            "repositories": self.repositories,
+            "components": list(self.components.values()),
+            "repo_releases": self.repo_releases,
+            "distributions": self.distributions,
+            "groups": self.groups,
+            "products": self.products,
+            "me": self.me,
+            "package_indexes": [
+                {"repository": index.repository, "release": index.release,
+                "packages": {name: sorted(components) for (name, components) in index.components.items()}}
+                for index in list(self.package_indexes.values())
+            ],
+        }
+        data = json.dumps(catalog, separators=(",", ":")).encode("utf-8")
+        # The snapshot may be saved from several threads at once, each of them needs its own temporary file.
+        tmp = "{}.{}.tmp".format(filename, threading.get_ident())
+        with open(tmp, "wb") as f:
+            f.write(MAGIC + bytes((VERSION,)))
+            f.write(zlib.compress(data, 9))
+        os.replace(tmp, filename)
+    
+    def matches(self, api):
+        return self.created is not None and self.root == api.root and self.username == (api.username if api.token else None)
+    
+    def component(self, identifier):
+        return self.components[identifier]
+    
+    def distribution(self, key):
+        if self._distributions is None:
+            self._distributions = {i["id"]: i for i in self.distributions}
+        return self._distributions[key]
+    
+    def list_products(self, repository):
+        return self.products.get(repository, [])
+    
+    def package_index(self, repository, release):
+        return self.package_indexes[repository, release]
+    
+    def add_package_index(self, index):
+        self.package_indexes[index.repository, index.release] = index
+    
+    def is_due(self, now=None):
+        return self.created is None or (now or time.time()) - self.created >= REFRESH_AFTER
+    
+    def refresh(self, api, package_indexes=True, map=None):
+        # Fetches the catalog again and replaces only the parts that have changed. Unchanged responses are
+        # cheap thanks to the conditional requests of the API response cache. The memo of the API and fresh cache
+        # entries are bypassed, every response is confirmed by the server. Package listings are not cached, so
+        # a background refresh leaves the indexes alone, they are updated when the user opens their release.
+        # Requests are fanned out with map, api.map by default.
+        map = map or api.map
+        
+        def fetch(path, **params):
+            return api.make_request(path, params=params, revalidate=True)
+        
+        changed = False
+        repositories = fetch("repository/repositories/")
+        pks = sorted({pk for repo in repositories for pk in repo.get("component_set", ())})
+        components = {c["id"]: c for c in map(lambda pk: fetch("repository/components/{}/".format(pk)), pks)}
+        products = {repo["id"]: repo_products for (repo, repo_products) in zip(repositories,
+            map(lambda repo: fetch("repository/products/", repository=repo["id"]), repositories))}
+        update = {
+            "repositories": repositories,
+            "components": components,
+            "repo_releases": fetch("repository/releases/"),
+            "distributions": fetch("repository/distributions/"),
+            "groups": fetch("auth/groups/"),
+            "products": products,
+            "me": fetch("me/"),
+        }
+        if package_indexes:
+            # Only package indexes of releases the user has already visited are kept, fetching all of them would
+            # be too expensive.
+            keys = list(self.package_indexes)
+            update["package_indexes"] = dict(zip(keys, map(lambda key: PackageIndex.from_packages(
+                key[0], key[1], api.iter_packages(repository=key[0], release=key[1])), keys)))
+        for name, value in update.items():
+            if getattr(self, name) != value:
+                setattr(self, name, value)
+                changed = True
+        if changed:
+            self._distributions = None
+        # Only now the whole catalog is known to be current.
+        self.created = time.time()
+        return changed
@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+class EntityStore:
+    def __init__(self, fetch, load_all=None, max_size=1024, negative_ttl=60.0, not_found=(LookupError,), map=map):
+        self.fetch = fetch
+        self.load_all = load_all
+        self.max_size = max_size
+        self.negative_ttl = negative_ttl
+        self.not_found = not_found
+        self.map = map
+        self._entries = OrderedDict()
+        self._missing = {}
+        self._calls = {}
+        self._seeded = False
+        self._lock = threading.Lock()
+        self._seed_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+    
+    def get(self, key):
+        self._seed()
+        while True:
+            with self._lock:
+                try:
+                    entity = self._entries[key]
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entity
+                except KeyError:
+                    pass
+                
+                missing = self._missing.get(key)
+                if missing is not None:
+                    expires, error = missing
+                    if expires > time.monotonic():
+                        self.negative_hits += 1
+                        raise error
+                    del self._missing[key]
+                
+                call = self._calls.get(key)
+                owner = call is None
+                if owner:
+                    self.misses += 1
+                    call = self._calls[key] = Future()
+            
+            if owner:
+                break
+            try:
+                return call.result()
+            except Exception as e:
+                # See Memo.get(), a failure specific to the caller which made the call is not shared.
+                if not getattr(e, "caller_specific", False):
+                    raise
+        
+        try:
+            entity = self.fetch(key)
+        except self.not_found as e:
+            with self._lock:
+                self._missing[key] = (time.monotonic() + self.negative_ttl, e)
+                self._finish(key, call)
+            call.set_exception(e)
+            raise
+        except BaseException as e:
+            with self._lock:
+                self._finish(key, call)
+            call.set_exception(e)
+            raise
+        
+        with self._lock:
+            if self._finish(key, call):
+                self._put(key, entity)
+        call.set_result(entity)
+        return entity
+    
+    def get_many(self, keys):
+        # Cached entities are returned right away, all misses are fetched at once.
+        keys = list(keys)
+        self._seed()
+        with self._lock:
+            found = {key: self._entries[key] for key in keys if key in self._entries}
+        missing = list(OrderedDict.fromkeys(key for key in keys if key not in found))
+        found.update(zip(missing, self.map(self.get, missing)))
+        return [found[key] for key in keys]
+    
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._missing.clear()
+            self._calls.clear()
+            self._seeded = False
+    
+    def _seed(self):
+        if self._seeded or self.load_all is None:
+            return
+        with self._seed_lock:
+            if self._seeded:
+                return
+            entities = self.load_all()
+            with self._lock:
+                for entity in entities:
+                    self._put(entity["id"], entity)
+                self._seeded = True
+    
+    def _finish(self, key, call):
+        # Returns False if the store has been invalidated while the call was in progress.
+        if self._calls.get(key) is call:
+            del self._calls[key]
+            return True
+        return False
+    
+    def _put(self, key, entity):
+        self._entries[key] = entity
+        self._entries.move_to_end(key)
+        self._missing.pop(key, None)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
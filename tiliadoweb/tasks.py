@@ -0,0 +1,60 @@
+from concurrent.futures import ThreadPoolExecutor
+from gi.repository import GLib
+
+class Task:
+    def __init__(self):
+        self.cancelled = False
+        self.deadline = None
+        self.future = None
+    
+    def cancel(self):
+        # A request which is already in flight cannot be interrupted, but its deadline makes the API give up
+        # instead of retrying and its result is never delivered.
+        self.cancelled = True
+        if self.future is not None:
+            self.future.cancel()
+        if self.deadline is not None:
+            self.deadline.cancel()
+
+class TaskRunner:
+    # Runs blocking work on worker threads and hands the results over to the GTK main loop. Only the latest
+    # task delivers its result, starting a new one cancels the previous one.
+    def __init__(self, max_workers=2):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.current = None
+    
+    def run(self, func, on_done=None, on_error=None):
+        self.cancel()
+        task = self.current = Task()
+        task.future = self.executor.submit(self._run, task, func, on_done, on_error)
+        return task
+    
+    def cancel(self):
+        task, self.current = self.current, None
+        if task is not None:
+            task.cancel()
+    
+    def shutdown(self):
+        # Worker threads are joined at exit, so that nothing may be left queued or retrying.
+        self.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _run(self, task, func, on_done, on_error):
+        if task.cancelled:
+            return
+        try:
+            result = func(task)
+        except Exception as e:
+            if not task.cancelled:
+                print("Task failed: {}".format(e))
+            GLib.idle_add(self._deliver, task, on_error, e)
+        else:
+            GLib.idle_add(self._deliver, task, on_done, result)
+    
+    def _deliver(self, task, callback, value):
+        if not task.cancelled:
+            if self.current is task:
+                self.current = None
+            if callback is not None:
+                callback(value)
+        return False
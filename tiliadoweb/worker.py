@@ -1,11 +1,49 @@
+import os
 import subprocess
 import threading
+from collections import deque
 
 def run_command(args, output_callback=None, exit_callback=None):
     runner = SubprocessWorker(args, output_callback, exit_callback)
     runner.start()
     return runner
 
+class WakeupQueue:
+    # A queue whose readiness can be watched by a main loop: a byte is written to a pipe when the queue becomes
+    # non-empty, so that the reader only wakes up when there is something to process.
+    def __init__(self):
+        self._items = deque()
+        self._pending = False
+        self._lock = threading.Lock()
+        self._read_fd, self._write_fd = os.pipe()
+    
+    def fileno(self):
+        return self._read_fd
+    
+    def put(self, item):
+        with self._lock:
+            self._items.append(item)
+            if not self._pending and self._write_fd is not None:
+                self._pending = True
+                os.write(self._write_fd, b"\0")
+    
+    def get_all(self):
+        with self._lock:
+            if self._pending:
+                self._pending = False
+                os.read(self._read_fd, 1)
+            items = list(self._items)
+            self._items.clear()
+        return items
+    
+    def close(self):
+        with self._lock:
+            fds = self._read_fd, self._write_fd
+            self._read_fd = self._write_fd = None
+        for fd in fds:
+            if fd is not None:
+                os.close(fd)
+
 class SubprocessWorker(threading.Thread):
     def __init__(self, command, output_callback=None, exit_callback=None):
         threading.Thread.__init__(self)